@@ -0,0 +1,152 @@
+"""
+A cache of protrack metadata that outlives a load
+
+Programs, series and descriptions hardly change once something is scheduled,
+MetadataCache keeps what ProtrackLookup fetched in a django table so the next
+run only asks informix for what's new.  quad_tab has no up_date, so programs
+and series expire after a TTL; descriptions are evicted by refresh() when
+their progdesc rows change.
+
+Entries are written mid load, while the loader's own transaction is open for
+a whole batch.  set_many() writes them on a connection of its own (WRITER, a
+copy of "default") and commits straight away, so workers prefetching the same
+programs never wait on each other's batches.
+"""
+import base64, logging
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from django.db import connections, transaction, DatabaseError
+
+from protrack.models import CachedMetadata
+from protrack.db.lookup import chunked
+from protrack.db.delta import server_time, changed_descriptions
+
+#how long program and series rows are trusted for
+TTL = timedelta(days = 7)
+
+#the row the server time of the last refresh() is kept in
+SYNCED = 'synced'
+
+#the database alias set_many() writes through
+WRITER = 'protrack_cache'
+
+logger = logging.getLogger('django_protrack')
+
+def writer():
+    """
+    the WRITER alias, added to the configured databases the first time it's asked for
+    """
+    if WRITER not in connections.databases:
+        connections.databases[WRITER] = dict(connections.databases["default"])
+    return WRITER
+
+_row_types = {}
+
+def _row_type(keys):
+    if keys not in _row_types:
+        _row_types[keys] = namedtuple('CachedRow', keys, rename = True)
+    return _row_types[keys]
+
+def encode_key(key):
+    if isinstance(key, tuple):
+        return ",".join(str(part) for part in key)
+    return str(key)
+
+def decode_key(kind, key):
+    parts = tuple(int(part) for part in key.split(","))
+    return parts if len(parts) > 1 else parts[0]
+
+def dumps(value):
+    """
+    rows are stored as (keys, values) so they come back with attribute access
+    """
+    if hasattr(value, '_fields'):
+        value = ('row', tuple(value._fields), tuple(value))
+    elif hasattr(value, 'keys') and not isinstance(value, dict):
+        value = ('row', tuple(value.keys()), tuple(value))
+    return base64.b64encode(pickle.dumps(value, pickle.HIGHEST_PROTOCOL)).decode('ascii')
+
+def loads(text):
+    value = pickle.loads(base64.b64decode(text))
+    if isinstance(value, tuple) and len(value) == 3 and value[0] == 'row':
+        return _row_type(value[1])(*value[2])
+    return value
+
+class MetadataCache(object):
+    """
+    program, series and description lookups kept in CachedMetadata
+    """
+    def __init__(self, ttl = TTL, chunk_size = 500):
+        self.ttl = ttl
+        self.chunk_size = chunk_size
+
+    def _entries(self):
+        return CachedMetadata.objects.using("default")
+
+    def refresh(self, session):
+        """
+        drop descriptions protrack changed since the last refresh, or all of them the first time
+        """
+        now = server_time(session)
+        try:
+            synced = self._entries().get(kind = SYNCED)
+        except CachedMetadata.DoesNotExist:
+            synced = CachedMetadata(kind = SYNCED, key = SYNCED)
+            stale = None
+        else:
+            stale = [encode_key(key) for key in changed_descriptions(session, loads(synced.value))]
+
+        with transaction.commit_on_success(using = "default"):
+            descriptions = self._entries().filter(kind = 'description')
+            if stale is None:
+                descriptions.delete()
+            else:
+                for chunk in chunked(stale, self.chunk_size):
+                    descriptions.filter(key__in = chunk).delete()
+
+            synced.value = dumps(now)
+            synced.fetched = datetime.now()
+            synced.save(using = "default")
+
+        return 0 if stale is None else len(stale)
+
+    def get_many(self, kind, keys):
+        """
+        the cached values for keys, a dict of whichever were found and still fresh
+        """
+        entries = self._entries().filter(kind = kind)
+        if kind != 'description':
+            entries = entries.filter(fetched__gte = datetime.now() - self.ttl)
+
+        found = {}
+        for chunk in chunked([encode_key(key) for key in keys], self.chunk_size):
+            for key, value in entries.filter(key__in = chunk).values_list('key', 'value'):
+                found[decode_key(kind, key)] = loads(value)
+        return found
+
+    def set_many(self, kind, values):
+        """
+        store a dict of key -> value, replacing anything cached for those keys
+        """
+        if not values:
+            return
+
+        fetched = datetime.now()
+        entries = sorted([CachedMetadata(kind = kind, key = encode_key(key), value = dumps(value), fetched = fetched)
+            for key, value in values.items()], key = lambda entry: entry.key)
+
+        using = writer()
+        try:
+            with transaction.commit_on_success(using = using):
+                for chunk in chunked([entry.key for entry in entries], self.chunk_size):
+                    CachedMetadata.objects.using(using).filter(kind = kind, key__in = chunk).delete()
+                CachedMetadata.objects.using(using).bulk_create(entries, batch_size = self.chunk_size)
+        except DatabaseError as e:
+            #another worker stored some of them first (or we collided with it), losing them only costs a query next time
+            logger.info("didn't cache %d %s entries: %s" % (len(entries), kind, e))
@@ -1,18 +1,102 @@
-import informixdb
-from sqlalchemy import create_engine
+"""
+The protrack engine and sessions
+
+Nothing connects (or imports informixdb) until a session is asked for.  The
+connection comes from django's PROTRACK_DATABASE setting:
+
+    PROTRACK_DATABASE = {
+        'DSN': 'protrack@ptrack_odbc',
+        'USER': '',
+        'PASSWORD': '',
+        'POOL_SIZE': 5,         # connections kept open
+        'MAX_OVERFLOW': 5,      # extra connections allowed under load
+        'POOL_TIMEOUT': 30,     # seconds to wait for a free connection
+        'POOL_RECYCLE': 3600,   # seconds before a connection is replaced
+    }
+
+Pooled connections are pinged when they're checked out, one informix dropped
+while we weren't looking is replaced rather than handed to the loader.
+"""
+import threading
+
+from sqlalchemy import create_engine, event, exc
 from sqlalchemy.orm import sessionmaker
 
-PROTRACK_USER = ""
-PROTRACK_PASSWORD = ""
+DEFAULTS = {
+    'DSN': 'protrack@ptrack_odbc',
+    'USER': '',
+    'PASSWORD': '',
+    'POOL_SIZE': 5,
+    'MAX_OVERFLOW': 5,
+    'POOL_TIMEOUT': 30,
+    'POOL_RECYCLE': 3600,
+}
+
+PING_SQL = "select 1 from systables where tabid = 1"
 
-def connect():
-    return informixdb.connect('protrack@ptrack_odbc', user=PROTRACK_USER, password=PROTRACK_PASSWORD)
+def database_settings():
+    """
+    DEFAULTS overridden by settings.PROTRACK_DATABASE
+    """
+    config = dict(DEFAULTS)
+    try:
+        from django.conf import settings
+        config.update(getattr(settings, 'PROTRACK_DATABASE', {}))
+    except ImportError:
+        pass
+    return config
+
+def connect(config = None):
+    import informixdb
+    config = config or database_settings()
+    return informixdb.connect(config['DSN'], user = config['USER'], password = config['PASSWORD'])
+
+def ping(dbapi_connection, connection_record, connection_proxy):
+    """
+    pool checkout listener, a connection that can't answer is swapped for a new one
+    """
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(PING_SQL)
+    except Exception:
+        raise exc.DisconnectionError()
+    finally:
+        try:
+            cursor.close()
+        except Exception:
+            pass
 
 def _fluck_protrack(*args, **kwargs):
     raise NotImplementedError()
 
-#we have to override the this because our informix doesn't support transactions or roles
-protrack_engine = create_engine('informix://', creator=connect, has_transactions = False)
-protrack_engine.dialect._get_default_schema_name = _fluck_protrack # this wasn't originally called fluck
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_engine():
+    """
+    the protrack engine, built on first use so importing protrack.db doesn't need informix
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            config = database_settings()
+            #we have to override the this because our informix doesn't support transactions or roles
+            _engine = create_engine('informix://', creator = lambda: connect(config), has_transactions = False,
+                pool_size = config['POOL_SIZE'], max_overflow = config['MAX_OVERFLOW'],
+                pool_timeout = config['POOL_TIMEOUT'], pool_recycle = config['POOL_RECYCLE'])
+            _engine.dialect._get_default_schema_name = _fluck_protrack # this wasn't originally called fluck
+            event.listen(_engine, 'checkout', ping)
+    return _engine
+
+_local = threading.local()
+
+def session_factory():
+    """
+    the calling thread's sessionmaker, so workers never share session state
+    """
+    if not hasattr(_local, 'factory'):
+        _local.factory = sessionmaker(bind = get_engine())
+    return _local.factory
 
-Session = sessionmaker(bind = protrack_engine)
\ No newline at end of file
+def Session(**kwargs):
+    return session_factory()(**kwargs)
@@ -0,0 +1,64 @@
+"""
+Change detection for incremental loads
+
+Protrack stamps air, guide and description rows with up_date, so given the
+server time of the last successful load we can ask which air dates of a
+channel have anything new on them and reload just those.
+"""
+from datetime import timedelta
+
+from protrack.db.static_query import server_time_sql, changed_air_dates_sql, changed_descriptions_sql
+
+def server_time(session):
+    """
+    the informix server's clock, watermarks must not depend on ours
+    """
+    return session.execute(server_time_sql).fetchone().now
+
+def changed_air_dates(session, channel_key, start, end, since):
+    """
+    the set of air dates between start and end with air, guide or description rows changed after since
+    """
+    params = {'channel_key': channel_key, 'start': start, 'end': end, 'since': since}
+    return set(row.airdate for row in session.execute(changed_air_dates_sql, params).fetchall())
+
+def changed_descriptions(session, since):
+    """
+    the set of (series, program, version) description keys with progdesc rows changed after since
+    """
+    rows = session.execute(changed_descriptions_sql, {'since': since}).fetchall()
+    return set((row.pde_ser_id, row.pde_prog_id, row.pde_vsn_id) for row in rows)
+
+def date_ranges(dates):
+    """
+    collapses dates into a sorted list of (first, last) runs of consecutive days
+    """
+    ranges = []
+    for day in sorted(dates):
+        if ranges and ranges[-1][1] + timedelta(days = 1) == day:
+            ranges[-1][1] = day
+        else:
+            ranges.append([day, day])
+
+    return [tuple(r) for r in ranges]
+
+def each_day(start, end):
+    """
+    the dates from start to end, inclusive
+    """
+    day = start
+    while day <= end:
+        yield day
+        day += timedelta(days = 1)
+
+def split_range(start, end, days):
+    """
+    splits start to end (inclusive) into a list of (first, last) chunks of at most days days
+    """
+    chunks = []
+    while start <= end:
+        last = min(end, start + timedelta(days = days - 1))
+        chunks.append((start, last))
+        start = last + timedelta(days = 1)
+
+    return chunks
@@ -0,0 +1,106 @@
+"""
+Air extraction built on the protrack models
+
+The loader's first airs query joined proguide with an informix outer join and
+grouped by every column to dedupe what the join multiplied.  Here the air rows
+are a plain distinct select in date and time order, and the guide text for a
+batch of them is fetched afterwards with one IN query per chunk of versions
+(select-in, the way ProtrackLookup fetches descriptions).  Statements are built from the models
+once and compiled to SQL strings, the IN queries once per list length, so
+every session wrapper (counting, recording, the sqlite stand-in) runs them like
+any other query.
+
+The distinct includes the season, which the guide text is keyed on.  Rows
+that differ only in season, which the old group by (on the guide text, not the
+season) folded together when their text matched, now both come back; the
+loader drops the repeated air (reconcile_airs, get_or_create, derive_airs).
+"""
+import threading
+
+from sqlalchemy import select, bindparam, and_
+
+from protrack.db.lookup import chunked, CHUNK_SIZE
+from protrack.db.models import Air13, SafeAir13, ProgramGuide
+from protrack.db.records import AirRow, BATCH_SIZE
+
+def compile_sql(statement):
+    """
+    a statement as SQL with :name binds, like the strings in static_query
+    """
+    return unicode(statement.compile())
+
+def _airs_statement(model):
+    return select([
+        model.series_id.label('series'),
+        model.season_id.label('season'),
+        model.episode_id.label('program'),
+        model.version_id.label('version'),
+        model.on_date.label('airdate'),
+        model.at_time.label('airtime'),
+        model.for_length.label('length'),
+    ], and_(
+        model.channel == bindparam('channel_key'),
+        model.on_date >= bindparam('start'),
+        model.on_date <= bindparam('end'),
+    ), distinct = True).order_by(model.on_date, model.at_time, model.version_id)
+
+#the schedule from today on, and as aired for the backlog
+AIRS = {
+    Air13: compile_sql(_airs_statement(Air13)),
+    SafeAir13: compile_sql(_airs_statement(SafeAir13)),
+}
+
+_guides = {}
+_guides_lock = threading.Lock()
+
+def guide_sql(size):
+    """
+    proguide text for size versions, bound as version_0 ... version_<size - 1>
+    """
+    with _guides_lock:
+        if size not in _guides:
+            _guides[size] = compile_sql(select([
+                ProgramGuide.series_id.label('series'),
+                ProgramGuide.season_id.label('season'),
+                ProgramGuide.episode_id.label('program'),
+                ProgramGuide.version_id.label('version'),
+                ProgramGuide.desc.label('text'),
+            ], and_(
+                ProgramGuide.version_id.in_([bindparam('version_%d' % i) for i in range(size)]),
+                ProgramGuide.desc != None,
+            )).order_by(ProgramGuide.id))
+        return _guides[size]
+
+def guides(session, keys, chunk_size = CHUNK_SIZE):
+    """
+    the guide text of each (series, season, program, version) key that has one
+    """
+    texts = {}
+    versions = sorted(set(key[3] for key in keys))
+    for chunk in chunked(versions, chunk_size):
+        params = dict(('version_%d' % i, version) for i, version in enumerate(chunk))
+        for row in session.execute(guide_sql(len(chunk)), params).fetchall():
+            #first guide row wins, like the outer join's first group
+            texts.setdefault((row.series, row.season, row.program, row.version), row.text)
+
+    return dict((key, texts[key]) for key in keys if key in texts)
+
+def air_batches(session, model, channel, start, end, batch_size = BATCH_SIZE, chunk_size = CHUNK_SIZE):
+    """
+    streams the airs of a channel from start to end (inclusive) out of model,
+    Air13 or SafeAir13, as lists of AirRow with their guide text filled in
+    """
+    params = {'channel_key': channel, 'start': start, 'end': end}
+    results = session.execute(AIRS[model], params)
+    try:
+        while True:
+            rows = results.fetchmany(batch_size)
+            if not rows:
+                break
+
+            keys = set((row.series, row.season, row.program, row.version) for row in rows)
+            texts = guides(session, keys, chunk_size)
+            yield [AirRow(row.series, row.program, row.version, row.airdate, row.airtime, row.length,
+                texts.get((row.series, row.season, row.program, row.version))) for row in rows]
+    finally:
+        results.close()
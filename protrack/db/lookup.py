@@ -0,0 +1,229 @@
+"""
+Batched program, series and description lookups against protrack
+
+The loader used to ask informix for a program, a series and a description for
+every air it processed.  ProtrackLookup collects the distinct keys out of a
+batch of air rows and fetches them with chunked IN lists instead, falling back
+to the single row queries for anything that wasn't prefetched.  Given a
+cache (protrack.cache.MetadataCache) it only asks informix for what that
+doesn't already have, and saves what it fetched there for the next run.
+"""
+from protrack.nola import NolaCode
+from protrack.db.static_query import (program_sql, description_sql, series_sql,
+    bulk_program_sql, bulk_description_sql, bulk_series_sql, bulk_series_description_sql)
+
+#informix is happy with a few hundred placeholders, keep it well under that
+CHUNK_SIZE = 200
+
+#protrack stores series descriptions as program = -1, version = -1
+SERIES_DESCRIPTION = (-1, -1)
+
+def chunked(values, size = CHUNK_SIZE):
+    """
+    yields lists of at most size items from values
+    """
+    chunk = []
+    for value in values:
+        chunk.append(value)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def in_list(name, values):
+    """
+    builds the placeholder list and bind params for an IN clause
+    """
+    params = {}
+    placeholders = []
+    for i, value in enumerate(values):
+        key = "%s_%d" % (name, i)
+        params[key] = value
+        placeholders.append(":%s" % key)
+
+    return ", ".join(placeholders), params
+
+class ProtrackLookup(object):
+    """
+    per run cache of protrack programs, series and descriptions
+    """
+    def __init__(self, session, chunk_size = CHUNK_SIZE, enc_type = 'utf8', cache = None):
+        self.session = session
+        self.chunk_size = chunk_size
+        self.enc_type = enc_type
+        #a protrack.cache.MetadataCache, or anything with its get_many/set_many, kept between runs
+        self.cache = cache
+
+        self.programs = {}
+        self.series = {}
+        self.descriptions = {}
+        #keys we have asked protrack about, a missing description is still an answer
+        self.described = set()
+
+    def _execute_in(self, sql, name, values, session = None):
+        """
+        runs sql once per chunk of values on session (ours by default), yielding every row
+        """
+        session = session or self.session
+        for chunk in chunked(values, self.chunk_size):
+            placeholders, params = in_list(name, chunk)
+            for row in session.execute(sql % {name: placeholders}, params).fetchall():
+                yield row
+
+    def _collect_descriptions(self, rows):
+        """
+        folds ordered progdesc rows into the descriptions map
+        """
+        texts = {}
+        for row in rows:
+            if row.pde_text is None:
+                continue
+            key = (row.pde_ser_id, row.pde_prog_id, row.pde_vsn_id)
+            texts.setdefault(key, []).append(unicode(row.pde_text, self.enc_type, errors = 'ignore'))
+
+        for key, parts in texts.items():
+            self.descriptions[key] = u" ".join(parts)
+
+    def prefetch(self, rows, session = None):
+        """
+        fetch everything a batch of air rows (AirRow) will need
+
+        given a session the queries run on that instead, so another thread can
+        prefetch while ours reads; entries are only added, each once it's complete
+        """
+        programs = set()
+        series = set()
+        keys = set()
+
+        for row in rows:
+            if row.program not in self.programs:
+                programs.add(row.program)
+            key = (row.series, row.program, row.version)
+            if key not in self.described:
+                keys.add(key)
+            if row.series not in self.series:
+                series.add(row.series)
+
+        #whatever the persistent cache has doesn't need asking for
+        programs = self._cached('program', programs, self.programs)
+        keys = self._cached_descriptions(keys)
+        versions = set(key[2] for key in keys)
+        series_keys = self._cached_descriptions(set((s,) + SERIES_DESCRIPTION for s in series))
+        series = self._cached('series', series, self.series)
+
+        fetched = {}
+        for row in self._execute_in(bulk_program_sql, 'programs', sorted(programs), session):
+            #quad_tab has a row per version, first one wins like program_sql's fetchone
+            fetched.setdefault(row.program, row)
+        self.programs.update(fetched)
+        self._store('program', fetched)
+        NolaCode.parse_many((row.nola_code, row.number) for row in fetched.values() if row.nola_code is not None)
+
+        if versions:
+            self._collect_descriptions(self._execute_in(bulk_description_sql, 'versions', sorted(versions), session))
+            self.described.update(keys)
+            self._store('description', dict((key, self.descriptions.get(key, u"")) for key in keys))
+
+        fetched = {}
+        for row in self._execute_in(bulk_series_sql, 'series', sorted(series), session):
+            fetched.setdefault(row.series, row)
+        self.series.update(fetched)
+        self._store('series', fetched)
+
+        if series_keys:
+            self._collect_descriptions(self._execute_in(bulk_series_description_sql, 'series',
+                sorted(key[0] for key in series_keys), session))
+            self.described.update(series_keys)
+            self._store('description', dict((key, self.descriptions.get(key, u"")) for key in series_keys))
+
+    def _cached(self, kind, wanted, found):
+        """
+        fills found from the persistent cache, returning the keys it didn't have
+        """
+        if self.cache is None or not wanted:
+            return wanted
+        hits = self.cache.get_many(kind, wanted)
+        found.update(hits)
+        return wanted - set(hits)
+
+    def _cached_descriptions(self, keys):
+        """
+        marks the cached description keys described, returning the rest
+        """
+        keys = set(key for key in keys if key not in self.described)
+        if self.cache is None or not keys:
+            return keys
+        hits = self.cache.get_many('description', keys)
+        for key, text in hits.items():
+            if text:
+                self.descriptions[key] = text
+        self.described.update(hits)
+        return keys - set(hits)
+
+    def _store(self, kind, values):
+        if self.cache is not None and values:
+            self.cache.set_many(kind, values)
+
+    def forget(self, keys = None, rows = False):
+        """
+        drop the descriptions of keys (all of them without keys) and, with rows,
+        every program and series row, so they're fetched again
+        """
+        if keys is None:
+            self.descriptions.clear()
+            self.described.clear()
+        else:
+            for key in keys:
+                self.descriptions.pop(key, None)
+                self.described.discard(key)
+
+        if rows:
+            self.programs.clear()
+            self.series.clear()
+
+    def program(self, program):
+        """
+        program_sql row for a program
+        """
+        if program not in self.programs:
+            self.programs[program] = self.session.execute(program_sql, {'program': program}).fetchone()
+        return self.programs[program]
+
+    def nola(self, program):
+        """
+        the parsed nola code of a program
+        """
+        row = self.program(program)
+        return NolaCode.parse(row.nola_code, row.number)
+
+    def series_row(self, series):
+        """
+        series_sql row for a series
+        """
+        if series not in self.series:
+            self.series[series] = self.session.execute(series_sql, {'series': series}).fetchone()
+        return self.series[series]
+
+    def description(self, series, program, version):
+        """
+        an episode description, or a series description with program = version = -1
+        """
+        key = (series, program, version)
+        if key not in self.described:
+            params = {'series': series, 'program': program, 'version': version}
+            self._collect_descriptions(
+                _KeyedRow(key, row) for row in self.session.execute(description_sql, params).fetchall())
+            self.described.add(key)
+
+        return self.descriptions.get(key, u"")
+
+class _KeyedRow(object):
+    """
+    gives a description_sql row the key columns of the bulk queries
+    """
+    __slots__ = ('pde_ser_id', 'pde_prog_id', 'pde_vsn_id', 'pde_text')
+
+    def __init__(self, key, row):
+        self.pde_ser_id, self.pde_prog_id, self.pde_vsn_id = key
+        self.pde_text = row.pde_text
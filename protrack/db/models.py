@@ -3,11 +3,10 @@ from sqlalchemy import Column, ForeignKey, and_
 from sqlalchemy.ext.declarative import declarative_base, declared_attr
 from sqlalchemy.orm import relationship, backref
 
-from protrack.db import protrack_engine
+from protrack.nola import NolaCode
 
-#sqlalchemy boilerplate
+#sqlalchemy boilerplate, sessions bring the engine so nothing here needs informix
 Base = declarative_base()
-Base.metadata.bind = protrack_engine
 
 class Series(Base):
     """
@@ -66,30 +65,17 @@ class Episode(Base):
     number = Column('vsn_order', SMALLINT)
     nola = Column('vsn_nola_code', CHAR(length = 15))
     
+    @property
+    def nola_code(self):
+        return NolaCode.parse(self.nola, self.number)
+
     @property
     def hd(self):
-        mod = None
-        needle = self.nola[6:]
-        
-        if len(needle) > 6:
-            mod = needle[6:]
-            
-        if mod == 'H' or mod == 'Z':
-            return True
-        
-        return False
+        return self.nola_code.hd
     
     @property
     def season_number(self):
-        needle = self.nola[6:]
-        
-        if len(needle) > 6:
-            needle = needle[0:6]
-        
-        if self.number >= 100:
-            return needle[0:(len(needle)-3)]
-        else:
-            return needle[0:(len(needle)-2)]
+        return self.nola_code.season
             
 class ProgramGuide(Base):
     """
@@ -121,33 +107,10 @@ class ProgramGuide(Base):
     #episode = relationship(Episode, primaryjoin = Episode.id == episode_id, foreign_keys = [Episode.id])
 
 
-class Air(Base):
-    __tablename__ = "air"
-    __table_args__ = ({'autoload': False})
-    
-    id = Column('ai_serial', Integer, primary_key = True)
-    series_id = Column('ai_ser_id', Integer)
-    season_id = Column('ai_sea_id', Integer)
-    episode_id = Column('ai_prog_id', Integer)
-    version_id = Column('ai_vsn_id', Integer)
-    on_date = Column('ai_air_date', DATE)
-    at_time = Column('ai_air_time', CHAR(length = 11))
-    for_length = Column('ai_air_len', CHAR(length = 11))
-    
-    guide = relationship(ProgramGuide, primaryjoin = and_(
-                series_id == ProgramGuide.series_id,
-                season_id == ProgramGuide.season_id,
-                episode_id == ProgramGuide.episode_id,
-                version_id == ProgramGuide.version_id,
-            ),foreign_keys=[
-                ProgramGuide.series_id,
-                ProgramGuide.season_id,
-                ProgramGuide.episode_id,
-                ProgramGuide.version_id
-            ])
-            
-class Air13(Base):
-    __tablename__ = "air13"
+class AirMixin(object):
+    """
+    the columns every protrack air table (air, air13, safeair13) shares
+    """
     __table_args__ = ({'autoload': False})
     
     id = Column('ai_serial', Integer, primary_key = True)
@@ -155,27 +118,18 @@ class Air13(Base):
     season_id = Column('ai_sea_id', Integer)
     episode_id = Column('ai_prog_id', Integer)
     version_id = Column('ai_vsn_id', Integer)
+    channel = Column('ai_virt_chnl', CHAR(length = 10))
     on_date = Column('ai_air_date', DATE)
     at_time = Column('ai_air_time', CHAR(length = 11))
     for_length = Column('ai_air_len', CHAR(length = 11))
     
-    guide = relationship(ProgramGuide, primaryjoin = and_(
-                series_id == ProgramGuide.series_id,
-                season_id == ProgramGuide.season_id,
-                episode_id == ProgramGuide.episode_id,
-                version_id == ProgramGuide.version_id,
-            ),foreign_keys=[
-                ProgramGuide.series_id,
-                ProgramGuide.season_id,
-                ProgramGuide.episode_id,
-                ProgramGuide.version_id
-            ])
-"""
-guide = relationship("ProgramGuide", primaryjoin = and_(
-                "ProgramGuide.series_id == Air.series_id",
-                "ProgramGuide.season_id == Air.season_id",
-                "ProgramGuide.episode_id == Air.episode_id",
-                "ProgramGuide.version_id == Air.version_id",
+    @declared_attr
+    def guide(cls):
+        return relationship(ProgramGuide, primaryjoin = and_(
+                cls.series_id == ProgramGuide.series_id,
+                cls.season_id == ProgramGuide.season_id,
+                cls.episode_id == ProgramGuide.episode_id,
+                cls.version_id == ProgramGuide.version_id,
             ),foreign_keys=[
                 ProgramGuide.series_id,
                 ProgramGuide.season_id,
@@ -183,12 +137,17 @@ guide = relationship("ProgramGuide", primaryjoin = and_(
                 ProgramGuide.version_id
             ])
 
-
-class SafeAir(AirMixin, Base):
-    __tablename__ = "safeair"
-    __table_args__ = ({'autoload': False})
-      
+class Air(AirMixin, Base):
+    __tablename__ = "air"
+            
 class Air13(AirMixin, Base):
+    """
+    the schedule from today on
+    """
+    __tablename__ = "air13"
 
-class SafeAir13(AirMixin, Base)
-"""
\ No newline at end of file
+class SafeAir13(AirMixin, Base):
+    """
+    the schedule as aired, what the backlog is loaded from
+    """
+    __tablename__ = "safeair13"
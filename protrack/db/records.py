@@ -0,0 +1,69 @@
+"""
+Lightweight records for rows streamed out of protrack
+
+SQLAlchemy's RowProxy keeps its whole result around, these just hold the
+columns the loader reads so a batch can be dropped as soon as it's processed.
+Air times and lengths come out of protrack as HH:MM:SS:FF strings, they're
+decoded once per batch into times, durations and start/end datetimes.
+"""
+from datetime import datetime, time, timedelta
+
+#rows per fetchmany, the prefetch for a batch is sized off this too
+BATCH_SIZE = 500
+
+#distinct time strings kept decoded, a schedule has a few hundred of them
+CLOCK_CACHE_SIZE = 5000
+
+#the longest duration a time column can hold
+LONGEST = time(23, 59, 59)
+
+_clocks = {}
+
+def clock(value):
+    """
+    (time, timedelta) for a protrack HH:MM:SS:FF string, read by position so
+    whatever separates the frames (";FF", ".FF") doesn't matter
+
+    lengths of 24 hours or more keep their real timedelta, their time is
+    capped at 23:59:59
+    """
+    try:
+        return _clocks[value]
+    except KeyError:
+        pass
+
+    hours, minutes, seconds = int(value[0:2]), int(value[3:5]), int(value[6:8])
+    span = timedelta(hours = hours, minutes = minutes, seconds = seconds)
+    at = time(hours, minutes, seconds) if hours < 24 else LONGEST
+
+    if len(_clocks) >= CLOCK_CACHE_SIZE:
+        _clocks.clear()
+    _clocks[value] = (at, span)
+    return at, span
+
+class AirRow(object):
+    """
+    a row of air13/safeair13 with its guide text
+
+    airtime and length are protrack's strings, time and duration the decoded
+    times, start and end the datetimes the air spans
+    """
+    __slots__ = ('series', 'program', 'version', 'airdate', 'airtime', 'length', 'short_description',
+        'time', 'duration', 'start', 'end')
+
+    def __init__(self, series, program, version, airdate, airtime, length, short_description):
+        self.series = series
+        self.program = program
+        self.version = version
+        self.airdate = airdate
+        self.airtime = airtime
+        self.length = length
+        self.short_description = short_description
+
+        self.time, offset = clock(airtime)
+        self.duration, span = clock(length)
+        self.start = datetime.combine(airdate, time()) + offset
+        self.end = self.start + span
+
+    def __repr__(self):
+        return "<AirRow %s/%s/%s %s %s>" % (self.series, self.program, self.version, self.airdate, self.airtime)
@@ -0,0 +1,154 @@
+"""
+Record and replay of protrack query results
+
+A RecordingSession wraps a real protrack session and keeps every row the
+loader reads, a Recording saves them to a gzipped pickle, and a ReplaySession
+serves them back through the same execute()/fetch* interface with no informix
+at all.  Replays have to take the same path through the loader as the recorded
+run (same services, day and options) to find their queries.
+"""
+import gzip, threading
+from collections import namedtuple
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+class Recording(object):
+    """
+    query results keyed on (sql, params)
+
+    run keeps what dated and windowed the recorded load (today, horizon,
+    chunk_days, batch_size, pipeline) so a replay asks the same queries on any day
+    """
+    def __init__(self, results = None, run = None):
+        self.results = results or {}
+        self.run = run or {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(sql, params):
+        return (sql, tuple(sorted((params or {}).items())))
+
+    def entry(self, sql, params, keys):
+        """
+        the row list to record a result into, queries asked twice are kept once
+        """
+        key = self.key(sql, params)
+        with self._lock:
+            if key in self.results:
+                return None
+            rows = []
+            self.results[key] = (tuple(keys), rows)
+            return rows
+
+    def save(self, path):
+        out = gzip.open(path, 'wb')
+        try:
+            pickle.dump({'results': self.results, 'run': self.run}, out, pickle.HIGHEST_PROTOCOL)
+        finally:
+            out.close()
+
+    @classmethod
+    def load(cls, path):
+        infile = gzip.open(path, 'rb')
+        try:
+            saved = pickle.load(infile)
+        finally:
+            infile.close()
+        return cls(saved['results'], saved['run'])
+
+class RecordingResult(object):
+    """
+    passes a result through, copying every row fetched into the recording
+    """
+    def __init__(self, result, rows):
+        self.result = result
+        self.rows = rows
+
+    def _record(self, rows):
+        if self.rows is not None:
+            self.rows.extend(tuple(row) for row in rows)
+        return rows
+
+    def keys(self):
+        return self.result.keys()
+
+    def fetchone(self):
+        row = self.result.fetchone()
+        if row is not None:
+            self._record([row])
+        return row
+
+    def fetchmany(self, size = None):
+        return self._record(self.result.fetchmany(size))
+
+    def fetchall(self):
+        return self._record(self.result.fetchall())
+
+    def close(self):
+        self.result.close()
+
+class RecordingSession(object):
+    """
+    a protrack session that records what it returns
+    """
+    def __init__(self, session, recording):
+        self.session = session
+        self.recording = recording
+
+    def execute(self, sql, params = None):
+        result = self.session.execute(sql, params or {})
+        return RecordingResult(result, self.recording.entry(sql, params, result.keys()))
+
+    def close(self):
+        self.session.close()
+
+class ReplayResult(object):
+    """
+    a recorded result, rows have the same attribute access as RowProxy
+    """
+    def __init__(self, keys, rows):
+        row_type = namedtuple('ReplayRow', keys, rename = True)
+        self._keys = list(keys)
+        self.rows = [row_type(*row) for row in rows]
+        self.position = 0
+
+    def keys(self):
+        return self._keys
+
+    def fetchmany(self, size = None):
+        size = size or 1
+        rows = self.rows[self.position:self.position + size]
+        self.position += len(rows)
+        return rows
+
+    def fetchone(self):
+        rows = self.fetchmany(1)
+        return rows[0] if rows else None
+
+    def fetchall(self):
+        rows = self.rows[self.position:]
+        self.position = len(self.rows)
+        return rows
+
+    def close(self):
+        pass
+
+class ReplaySession(object):
+    """
+    a protrack session that only knows what a recording saw
+    """
+    def __init__(self, recording):
+        self.recording = recording
+
+    def execute(self, sql, params = None):
+        try:
+            keys, rows = self.recording.results[Recording.key(sql, params)]
+        except KeyError:
+            raise KeyError("query not in the recording: %s %r" % (" ".join(sql.split()), params))
+        return ReplayResult(keys, rows)
+
+    def close(self):
+        pass
@@ -0,0 +1,137 @@
+"""
+A synthetic SQLite stand-in for the protrack tables the loader reads
+
+build() creates quad_tab, progdesc, proguide, air13 and safeair13 in a sqlite
+file and fills them with made up series, versions and airs for a set of
+channels.  StandinSession runs the loader's queries against it, translating the
+few that are informix dialect.
+"""
+import random, sqlite3
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from protrack.db.static_query import server_time_sql
+
+SCHEMA = """
+create table quad_tab (
+    ser_serial integer, ser_title char(50), ser_nola_base char(6),
+    pg_serial integer, pg_title char(50),
+    vsn_serial integer, vsn_total smallint, vsn_order smallint, vsn_nola_code char(15)
+);
+create table progdesc (
+    pde_ser_id integer, pde_sea_id integer, pde_prog_id integer, pde_vsn_id integer,
+    pde_disp_ord smallint, pde_text char(70), up_by integer, up_type char(1), up_date timestamp
+);
+create table proguide (
+    pgu_serial integer primary key, pgu_ser_id integer, pgu_sea_id integer, pgu_prog_id integer,
+    pgu_vsn_id integer, pgu_location char(15), pgu_text char(1024), up_by integer, up_type char(1), up_date timestamp
+);
+create table air13 (
+    ai_serial integer primary key, ai_ser_id integer, ai_sea_id integer, ai_prog_id integer, ai_vsn_id integer,
+    ai_virt_chnl char(10), ai_air_date date, ai_air_time char(11), ai_air_len char(11), up_date timestamp
+);
+create table safeair13 (
+    ai_serial integer primary key, ai_ser_id integer, ai_sea_id integer, ai_prog_id integer, ai_vsn_id integer,
+    ai_virt_chnl char(10), ai_air_date date, ai_air_time char(11), ai_air_len char(11), up_date timestamp
+);
+create index air13_chnl on air13 (ai_virt_chnl, ai_air_date);
+create index safeair13_chnl on safeair13 (ai_virt_chnl, ai_air_date);
+create index quad_tab_pg on quad_tab (pg_serial);
+create index quad_tab_ser on quad_tab (ser_serial);
+create index progdesc_vsn on progdesc (pde_vsn_id);
+create index progdesc_ser on progdesc (pde_ser_id);
+"""
+
+#informix dialect the loader speaks -> what sqlite understands, everything else runs as is
+TRANSLATIONS = {
+    server_time_sql: 'select current_timestamp as "now [timestamp]"',
+}
+
+def engine_for(path):
+    """
+    a sqlite engine that hands back dates, datetimes and byte strings like informixdb does
+    """
+    def connect():
+        connection = sqlite3.connect(path, detect_types = sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
+            check_same_thread = False)
+        connection.text_factory = str
+        return connection
+
+    return create_engine('sqlite://', creator = connect)
+
+def build(path, channels, start, end, series = 20, versions = 26, airs_per_day = 48, seed = 0):
+    """
+    fill a sqlite file with a synthetic schedule for channels from start to end
+
+    every series has versions episodes over one or two seasons, each channel
+    gets airs_per_day back to back airs a day, dates before today go to safeair13
+    """
+    rng = random.Random(seed)
+    today = date.today()
+    stamp = datetime.now().replace(microsecond = 0)
+
+    connection = sqlite3.connect(path)
+    connection.executescript(SCHEMA)
+
+    quad = []
+    descriptions = []
+    guides = []
+    episodes = []
+    for s in range(1, series + 1):
+        base = "SR%04d" % s
+        title = "the %s show number %d" % (rng.choice(["pbs", "bbc", "nova", "garden", "kitchen"]), s)
+        descriptions.append((s, -1, -1, -1, 1, "series %d description" % s, 1, 'U', stamp))
+        for v in range(1, versions + 1):
+            version = s * 1000 + v
+            season, number = divmod(v - 1, 13)
+            nola = "%-6s%04d%02d%s" % (base, season + 1, number + 1, "H" if rng.random() < 0.3 else "")
+            quad.append((s, title.upper(), base, version, "episode %d of %s" % (v, title), version, versions, number + 1, nola))
+            descriptions.append((s, season + 1, version, version, 1, "episode %d, part one" % v, 1, 'U', stamp))
+            descriptions.append((s, season + 1, version, version, 2, "episode %d, part two" % v, 1, 'U', stamp))
+            guides.append((s, season + 1, version, version, "", "guide text for %d" % version, 1, 'U', stamp))
+            episodes.append((s, season + 1, version))
+
+    connection.executemany("insert into quad_tab values (?, ?, ?, ?, ?, ?, ?, ?, ?)", quad)
+    connection.executemany("insert into progdesc values (?, ?, ?, ?, ?, ?, ?, ?, ?)", descriptions)
+    connection.executemany("insert into proguide (pgu_ser_id, pgu_sea_id, pgu_prog_id, pgu_vsn_id, pgu_location, "
+        "pgu_text, up_by, up_type, up_date) values (?, ?, ?, ?, ?, ?, ?, ?, ?)", guides)
+
+    length = 24 * 60 * 60 // airs_per_day
+    air_len = "%02d:%02d:%02d:00" % (length // 3600, length % 3600 // 60, length % 60)
+    airs = {'air13': [], 'safeair13': []}
+    day = start
+    while day <= end:
+        for channel in channels:
+            for slot in range(airs_per_day):
+                at = slot * length
+                ser, sea, version = rng.choice(episodes)
+                row = (ser, sea, version, version, channel, day,
+                    "%02d:%02d:%02d:00" % (at // 3600, at % 3600 // 60, at % 60), air_len, stamp)
+                airs['safeair13' if day < today else 'air13'].append(row)
+                if day == today:
+                    airs['safeair13'].append(row)
+        day += timedelta(days = 1)
+
+    for table, rows in airs.items():
+        connection.executemany("insert into %s (ai_ser_id, ai_sea_id, ai_prog_id, ai_vsn_id, ai_virt_chnl, "
+            "ai_air_date, ai_air_time, ai_air_len, up_date) values (?, ?, ?, ?, ?, ?, ?, ?, ?)" % table, rows)
+
+    connection.commit()
+    connection.close()
+
+    return dict(series = series, versions = series * versions, airs = sum(len(rows) for rows in airs.values()))
+
+class StandinSession(object):
+    """
+    a protrack session over the stand-in
+    """
+    def __init__(self, engine):
+        self.session = sessionmaker(bind = engine)()
+
+    def execute(self, sql, params = None):
+        return self.session.execute(TRANSLATIONS.get(sql, sql), params or {})
+
+    def close(self):
+        self.session.close()
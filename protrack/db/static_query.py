@@ -1,39 +1,3 @@
-airs_sql = """
-select
-a.ai_ser_id as series,  
-a.ai_prog_id as program,  a.ai_vsn_id as version, 
-a.ai_air_date as airdate, a.ai_air_time as airtime, 
-a.ai_air_len as length, p.pgu_text as short_description
-from air13 a, outer proguide p 
-where a.ai_air_date >= :start 
-and a.ai_air_date <= :end 
-and a.ai_virt_chnl = :channel_key
-and p.pgu_ser_id = a.ai_ser_id
-and p.pgu_sea_id = a.ai_sea_id 
-and p.pgu_prog_id = a.ai_prog_id 
-and p.pgu_vsn_id = a.ai_vsn_id 
-group by ai_ser_id, ai_prog_id, ai_vsn_id, ai_air_date, ai_air_time, ai_air_len, pgu_text
-order by a.ai_air_date asc
-"""
-
-safe_airs_sql = """
-select
-a.ai_ser_id as series,  
-a.ai_prog_id as program,  a.ai_vsn_id as version, 
-a.ai_air_date as airdate, a.ai_air_time as airtime, 
-a.ai_air_len as length, p.pgu_text as short_description
-from safeair13 a, outer proguide p 
-where a.ai_air_date >= :start 
-and a.ai_air_date <= :end 
-and a.ai_virt_chnl = :channel_key
-and p.pgu_ser_id = a.ai_ser_id
-and p.pgu_sea_id = a.ai_sea_id 
-and p.pgu_prog_id = a.ai_prog_id 
-and p.pgu_vsn_id = a.ai_vsn_id 
-group by ai_ser_id, ai_prog_id, ai_vsn_id, ai_air_date, ai_air_time, ai_air_len, pgu_text
-order by a.ai_air_date asc
-"""
-
 program_sql = """
 select distinct
 vsn_nola_code as nola_code, vsn_order as number, vsn_total as total, pg_title as title
@@ -55,4 +19,84 @@ series_sql = """
 select ser_nola_base as nola, ser_title as title
 from quad_tab
 where ser_serial = :series
-"""
\ No newline at end of file
+"""
+
+# bulk variants of the above, the IN lists are filled in with bind placeholders
+# by protrack.db.lookup so a whole batch of airs costs one round-trip per chunk
+
+bulk_program_sql = """
+select distinct
+pg_serial as program, vsn_nola_code as nola_code, vsn_order as number, vsn_total as total, pg_title as title
+from quad_tab
+where pg_serial in (%(programs)s)
+"""
+
+bulk_description_sql = """
+select pde_ser_id, pde_prog_id, pde_vsn_id, pde_text, pde_disp_ord
+from progdesc
+where pde_vsn_id in (%(versions)s)
+and pde_text is not null
+order by pde_ser_id, pde_prog_id, pde_vsn_id, pde_disp_ord asc
+"""
+
+bulk_series_sql = """
+select distinct ser_serial as series, ser_nola_base as nola, ser_title as title
+from quad_tab
+where ser_serial in (%(series)s)
+"""
+
+bulk_series_description_sql = """
+select pde_ser_id, pde_prog_id, pde_vsn_id, pde_text, pde_disp_ord
+from progdesc
+where pde_ser_id in (%(series)s)
+and pde_prog_id = -1
+and pde_vsn_id = -1
+and pde_text is not null
+order by pde_ser_id, pde_disp_ord asc
+"""
+
+# incremental loads, protrack stamps every air, guide and description row with up_date
+
+server_time_sql = """
+select current year to second as now
+from systables
+where tabid = 1
+"""
+
+changed_air_dates_sql = """
+select distinct a.ai_air_date as airdate
+from air13 a
+where a.ai_air_date >= :start
+and a.ai_air_date <= :end
+and a.ai_virt_chnl = :channel_key
+and a.up_date > :since
+union
+select distinct a.ai_air_date as airdate
+from air13 a, proguide p
+where a.ai_air_date >= :start
+and a.ai_air_date <= :end
+and a.ai_virt_chnl = :channel_key
+and p.pgu_ser_id = a.ai_ser_id
+and p.pgu_sea_id = a.ai_sea_id
+and p.pgu_prog_id = a.ai_prog_id
+and p.pgu_vsn_id = a.ai_vsn_id
+and p.up_date > :since
+union
+select distinct a.ai_air_date as airdate
+from air13 a, progdesc d
+where a.ai_air_date >= :start
+and a.ai_air_date <= :end
+and a.ai_virt_chnl = :channel_key
+and d.pde_ser_id = a.ai_ser_id
+and d.pde_prog_id in (a.ai_prog_id, -1)
+and d.pde_vsn_id in (a.ai_vsn_id, -1)
+and d.up_date > :since
+"""
+
+# persistent metadata cache, descriptions touched since the cache was last checked
+
+changed_descriptions_sql = """
+select distinct pde_ser_id, pde_prog_id, pde_vsn_id
+from progdesc
+where up_date > :since
+"""
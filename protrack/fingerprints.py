@@ -0,0 +1,53 @@
+"""
+Change detection for the records the loader writes
+
+A fingerprint is a digest of the protrack values a Series, Season or Episode
+was written from.  The loader compares it with the stored one before writing:
+a match means protrack has nothing new and the save is skipped, otherwise only
+the fields that differ are written.
+"""
+import hashlib
+
+from protrack.models import Fingerprint
+from protrack.cache import encode_key, decode_key
+from protrack.db.lookup import chunked
+
+def fingerprint(*values):
+    """
+    the digest of a tuple of protrack values
+    """
+    text = repr(tuple(value.encode('utf8') if isinstance(value, unicode) else value for value in values))
+    return hashlib.sha1(text.encode('utf8') if isinstance(text, unicode) else text).hexdigest()
+
+def load_fingerprints(kind, keys, batch_size = 500):
+    """
+    the stored digests of whichever keys have one
+    """
+    found = {}
+    for chunk in chunked([encode_key(key) for key in keys], batch_size):
+        for key, digest in Fingerprint.objects.using("default").filter(kind = kind, key__in = chunk).values_list('key', 'digest'):
+            found[decode_key(kind, key)] = digest
+    return found
+
+def save_fingerprint(kind, key, digest):
+    key = encode_key(key)
+    if not Fingerprint.objects.using("default").filter(kind = kind, key = key).update(digest = digest):
+        Fingerprint(kind = kind, key = key, digest = digest).save(using = "default")
+
+def assign(instance, values):
+    """
+    set instance's fields from a dict, returning the names of those that changed
+    """
+    changed = []
+    for name, value in values.items():
+        if getattr(instance, name) != value:
+            setattr(instance, name, value)
+            changed.append(name)
+    return changed
+
+def forget_fingerprints(kind, keys, batch_size = 500):
+    """
+    drop the digests of keys, their records were written some other way
+    """
+    for chunk in chunked([encode_key(key) for key in keys], batch_size):
+        Fingerprint.objects.using("default").filter(kind = kind, key__in = chunk).delete()
@@ -0,0 +1,116 @@
+"""
+Expiring service leases for loaders on one or more hosts
+
+Every claim, renewal and release is a single conditional statement against
+ServiceLease, so the database decides who holds a service.  A Heartbeat
+thread renews the leases a loader holds well before they expire, a loader
+that dies simply stops renewing and its services are free again after ttl.
+Leases compare against each host's clock, keep them in sync.
+"""
+import logging, os, socket, threading, uuid
+from datetime import datetime, timedelta
+
+from django.db import transaction, IntegrityError
+
+from protrack.models import ServiceLease
+from protrack.transactions import close_connection
+
+logger = logging.getLogger('django_protrack')
+
+#how long a lease lasts without a heartbeat
+TTL = timedelta(minutes = 5)
+
+def make_owner():
+    """
+    a name for this loader instance, unique across hosts and runs
+    """
+    return "%s:%d:%s" % (socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+
+def claim(service, owner, ttl = TTL):
+    """
+    take the service's lease if it's free, expired or already ours, returns whether we hold it
+    """
+    now = datetime.now()
+    leases = ServiceLease.objects.using("default").filter(service = service)
+    if leases.filter(owner = owner).update(expires = now + ttl):
+        return True
+    if leases.filter(expires__lt = now).update(owner = owner, acquired = now, expires = now + ttl):
+        return True
+
+    try:
+        with transaction.commit_on_success(using = "default"):
+            ServiceLease(service = service, owner = owner, acquired = now, expires = now + ttl).save(using = "default")
+    except IntegrityError:
+        #somebody else's lease, they got it first
+        return False
+    return True
+
+def renew(service, owner, ttl = TTL):
+    """
+    push our lease's expiry out, False if it's no longer ours
+    """
+    return bool(ServiceLease.objects.using("default").filter(service = service, owner = owner).update(
+        expires = datetime.now() + ttl))
+
+def release(service, owner):
+    ServiceLease.objects.using("default").filter(service = service, owner = owner).delete()
+
+class LeaseLost(Exception):
+    """
+    a service's lease expired or was taken while we were loading it
+    """
+
+class Heartbeat(threading.Thread):
+    """
+    renews the leases held by owner every third of ttl
+    """
+    def __init__(self, owner, ttl = TTL):
+        super(Heartbeat, self).__init__(name = 'protrack-lease-heartbeat')
+        self.daemon = True
+        self.owner = owner
+        self.ttl = ttl
+        self.held = {} # service pk -> Service
+        self.lost = set()
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+
+    def hold(self, service):
+        with self.lock:
+            self.held[service.pk] = service
+            self.lost.discard(service.pk)
+
+    def drop(self, service):
+        with self.lock:
+            self.held.pop(service.pk, None)
+            self.lost.discard(service.pk)
+
+    def check(self, service):
+        """
+        raise LeaseLost unless we still hold service
+        """
+        with self.lock:
+            if service.pk in self.lost or service.pk not in self.held:
+                raise LeaseLost("lost the lease on %s" % service.keyname)
+
+    def run(self):
+        interval = max(1, (self.ttl.days * 86400 + self.ttl.seconds) // 3)
+        try:
+            while not self.stopping.wait(interval):
+                with self.lock:
+                    held = list(self.held.values())
+                for service in held:
+                    try:
+                        renewed = renew(service, self.owner, self.ttl)
+                    except Exception:
+                        logger.exception("couldn't renew the lease on %s." % service.name)
+                        continue
+                    if not renewed:
+                        logger.error("lost the lease on %s." % service.name)
+                        with self.lock:
+                            self.lost.add(service.pk)
+        finally:
+            close_connection()
+
+    def stop(self):
+        self.stopping.set()
+        self.join()
@@ -0,0 +1,200 @@
+import json, logging, threading, time as clock
+from datetime import date, datetime, timedelta
+from optparse import make_option
+from Queue import Queue, Empty
+
+from django.db import transaction
+from django.core.management.base import BaseCommand, CommandError
+from protrack.db.models import SafeAir13
+from protrack.leases import Heartbeat, claim, release, make_owner
+from protrack.schedule import rebuild_days
+from protrack.stats import phase
+from protrack.transactions import close_connection
+from protrack.management.commands import load_protrack
+
+logger = logging.getLogger('django_protrack')
+
+#seconds between claims of a service another loader holds
+LEASE_POLL = 10
+
+def parse_date(value, option):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise CommandError('%s takes a YYYY-MM-DD date, not "%s"' % (option, value))
+
+def month_units(services, start, end):
+    """
+    (service, first, last) for every service and calendar month from start to end, clipped to the range
+    """
+    units = []
+    for service in services:
+        first = start
+        while first <= end:
+            if first.month == 12:
+                next_month = date(first.year + 1, 1, 1)
+            else:
+                next_month = date(first.year, first.month + 1, 1)
+            last = min(end, next_month - timedelta(days = 1))
+            units.append((service, first, last))
+            first = next_month
+
+    return units
+
+class Command(load_protrack.Command):
+    args = '<service_keyname service_keyname ...>'
+    help = ('Load the as-aired schedule (safeair13) of given or all services for a past date range, '
+        'a service and month at a time')
+    option_list = BaseCommand.option_list + (
+        make_option('--from', dest = 'from', metavar = 'YYYY-MM-DD',
+            help = 'First day to backfill'),
+        make_option('--to', dest = 'to', metavar = 'YYYY-MM-DD',
+            help = 'Last day to backfill, default yesterday'),
+    ) + tuple(o for o in load_protrack.Command.option_list
+        if o.dest in ('workers', 'batch_size', 'commit_every', 'schedule', 'no_cache', 'stats_file', 'pipeline',
+            'lease_ttl'))
+
+    def backfill(self, service, start, end):
+        """
+        reconcile a service's airs from start to end with safeair13, returns how many rows protrack had
+        """
+        with self.batch_transaction() as batch:
+            batches = self.fetch_airs(SafeAir13, service, start, end)
+            counter, airs, skipped, touched = self.process_airs(service, batches, batch, keep_to = end)
+            self.check_lease(service)
+            with phase(self.stats, 'air writes'):
+                changes = load_protrack.reconcile_airs(service, airs, start, end, self.batch_size, spare = skipped)
+
+        logger.info("backfilled %s %s to %s: %d airs, %d created, %d updated, %d deleted." % (
+            (service.name, start, end, counter) + changes[:3]))
+
+        #only the days whose airs (or their episodes) changed
+        days = changes[3] | touched
+        if self.schedule and days:
+            with phase(self.stats, 'schedule'):
+                with transaction.commit_on_success():
+                    rebuild_days(service, days, self.batch_size)
+
+        return counter
+
+    def backfill_leased(self, service, start, end):
+        """
+        backfill a unit under the service's lease, waiting for a load_protrack
+        (or another backfill) that holds it to finish, its backlog reconciles
+        the same days
+        """
+        #our own units of the service queue here, the lease can't tell our threads apart
+        with self.service_locks_lock:
+            service_lock = self.service_locks.setdefault(service.pk, threading.Lock())
+        with service_lock:
+            if not claim(service, self.heartbeat.owner, self.heartbeat.ttl):
+                logger.info("%s is being loaded elsewhere, waiting for it." % service.name)
+                while not claim(service, self.heartbeat.owner, self.heartbeat.ttl):
+                    clock.sleep(LEASE_POLL)
+
+            self.heartbeat.hold(service)
+            try:
+                return self.backfill(service, start, end)
+            finally:
+                self.heartbeat.drop(service)
+                release(service, self.heartbeat.owner)
+
+    def work(self, units, failures):
+        """
+        worker thread body, backfills units off the queue until it's empty
+        """
+        self.start_worker()
+        try:
+            while True:
+                try:
+                    service, start, end = units.get_nowait()
+                except Empty:
+                    break
+
+                try:
+                    self.stats.service(service.keyname)
+                    with phase(self.stats, 'load'):
+                        airs = self.backfill_leased(service, start, end)
+                except Exception:
+                    logger.exception("failed backfilling %s %s to %s." % (service.name, start, end))
+                    failures.append((service, start, end))
+                    airs = 0
+
+                self.progress(airs)
+        finally:
+            self.stop_worker()
+            close_connection()
+
+    def progress(self, airs):
+        with self.progress_lock:
+            self.done += 1
+            self.airs += airs
+            elapsed = max(clock.time() - self.clock_started, 0.001)
+            logger.info("backfill progress: %d/%d units, %d airs, %.1f airs/s." % (
+                self.done, self.total, self.airs, self.airs / elapsed))
+
+    def handle(self, *args, **options):
+        self.recording = self.replaying = None
+        services = self.setup(args, options)
+
+        if not options.get('from'):
+            raise CommandError('--from is required')
+        start = parse_date(options['from'], '--from')
+        end = parse_date(options['to'], '--to') if options.get('to') else date.today() - timedelta(days = 1)
+        if end >= date.today():
+            #today on belongs to load_protrack and its future air handling
+            raise CommandError('--to has to be before today')
+        if start > end:
+            raise CommandError('--from is after --to')
+
+        #history is reconciled and bulk written, never deleted wholesale
+        self.incremental = False
+        self.reconcile = True
+
+        units = month_units(services, start, end)
+        queue = Queue()
+        for unit in units:
+            queue.put(unit)
+
+        self.total = len(units)
+        self.done = self.airs = 0
+        self.progress_lock = threading.Lock()
+        self.clock_started = clock.time()
+        logger.info("backfilling %d units, %d services from %s to %s." % (len(units), len(services), start, end))
+
+        if self.cache is not None:
+            self.start_worker()
+            try:
+                self.refresh_cache()
+            finally:
+                self.stop_worker()
+
+        failures = []
+        workers = max(1, min(options.get('workers') or 1, len(units)))
+        threads = [threading.Thread(target = self.work, args = (queue, failures)) for i in range(workers)]
+        self.identity.shared = workers > 1
+        self.service_locks = {}
+        self.service_locks_lock = threading.Lock()
+        self.heartbeat = Heartbeat(make_owner(), timedelta(seconds = max(30, options.get('lease_ttl') or 300)))
+        self.heartbeat.start()
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            self.heartbeat.stop()
+
+        summary = self.stats.summary()
+        summary.update(units = len(units), airs = self.airs,
+            airs_per_second = round(self.airs / max(clock.time() - self.clock_started, 0.001), 1))
+        logger.info("protrack backfill stats: %s" % json.dumps(summary, sort_keys = True))
+        if options.get('stats_file'):
+            with open(options['stats_file'], 'w') as stats_file:
+                json.dump(summary, stats_file, sort_keys = True, indent = 2)
+
+        if failures:
+            raise CommandError('Failed backfilling: %s' % ", ".join(
+                "%s %s to %s" % (service.keyname, first, last) for service, first, last in failures))
+
+        logger.info("Completed protrack backfill of %d airs from %s to %s." % (self.airs, start, end))
@@ -0,0 +1,118 @@
+import json, os, resource, tempfile, time as clock
+from multiprocessing import Pool
+from datetime import date, timedelta
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from libazpm.contrib.chronologia.models import Service, Air
+from protrack.db import standin
+from protrack.management.commands import load_protrack
+
+class StandinLoad(load_protrack.Command):
+    """
+    load_protrack reading from the sqlite stand-in
+    """
+    def __init__(self, engine):
+        super(StandinLoad, self).__init__()
+        self.engine = engine
+
+    def open_session(self):
+        return standin.StandinSession(self.engine)
+
+class Command(BaseCommand):
+    args = '<service_keyname service_keyname ...>'
+    help = ('Benchmark load_protrack against a synthetic SQLite stand-in for protrack. '
+        'The load really writes episodes and airs, point it at a scratch database')
+    option_list = BaseCommand.option_list + (
+        make_option('--series', type = 'int', dest = 'series', default = 20,
+            help = 'Number of synthetic series'),
+        make_option('--versions', type = 'int', dest = 'versions', default = 26,
+            help = 'Versions (episodes) per series'),
+        make_option('--airs-per-day', type = 'int', dest = 'airs_per_day', default = 48,
+            help = 'Airs per channel per day'),
+        make_option('--seed', type = 'int', dest = 'seed', default = 0,
+            help = 'Random seed for the synthetic schedule'),
+        make_option('--keep', dest = 'keep', metavar = 'PATH',
+            help = 'Build the stand-in at PATH and keep it, rather than a temporary file'),
+        make_option('--json', action = 'store_true', dest = 'json', default = False,
+            help = 'Print the results as a single JSON object'),
+    ) + tuple(o for o in load_protrack.Command.option_list
+        if o.dest in ('reconcile', 'batch_size', 'staging', 'pipeline'))
+
+    def handle(self, *args, **options):
+        services = []
+        for keyname in args:
+            try:
+                services.append(Service.objects.using("default").get(keyname = keyname))
+            except Service.DoesNotExist:
+                raise CommandError('Service "%s" does not exist' % keyname)
+
+        if not services:
+            services = list(Service.objects.db_manager('default').protrack_services())
+
+        if not services:
+            raise CommandError('There are no services!')
+
+        today = date.today()
+        first_of_month = date(today.year, today.month, 1)
+        horizon = today + timedelta(days = 21)
+
+        path = options.get('keep')
+        if path is None:
+            fd, path = tempfile.mkstemp(suffix = '.sqlite')
+            os.close(fd)
+        elif os.path.exists(path):
+            raise CommandError('%s already exists' % path)
+
+        try:
+            #built in a process of its own, its row lists would otherwise be this one's peak memory
+            builder = Pool(1)
+            try:
+                sizes = builder.apply(standin.build, (path, [s.protrack_key for s in services], first_of_month,
+                    horizon), dict(series = options['series'], versions = options['versions'],
+                    airs_per_day = options['airs_per_day'], seed = options['seed']))
+            finally:
+                builder.close()
+                builder.join()
+
+            load = StandinLoad(standin.engine_for(path))
+            load_options = dict((o.dest, o.default) for o in load.option_list if o.dest)
+            #every build reuses the same ids, a cache from another run would be wrong
+            load_options.update(reconcile = options['reconcile'], batch_size = options['batch_size'], no_cache = True,
+                staging = options['staging'], pipeline = options['pipeline'], verbosity = 0)
+
+            #the peak so far is django's startup, the load's own is what it adds on top
+            baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            started = clock.time()
+            load.handle(*[s.keyname for s in services], **load_options)
+            wall = clock.time() - started
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline
+        finally:
+            if options.get('keep') is None:
+                os.remove(path)
+
+        airs = Air.objects.using("default").filter(service__in = services, date__gte = first_of_month).count()
+        stats = load.stats.summary()
+        protrack_queries = stats['protrack_queries']
+        django_queries = stats['django_queries']
+
+        results = {
+            'services': len(services),
+            'series': sizes['series'],
+            'versions': sizes['versions'],
+            'protrack_rows': sizes['airs'],
+            'airs': airs,
+            'wall_seconds': round(wall, 3),
+            'protrack_queries': protrack_queries,
+            'protrack_queries_per_air': round(float(protrack_queries) / max(airs, 1), 4),
+            'django_queries': django_queries,
+            'django_queries_per_air': round(float(django_queries) / max(airs, 1), 4),
+            #linux reports kilobytes
+            'peak_memory_kb': peak,
+        }
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, sort_keys = True))
+        else:
+            for key in sorted(results):
+                self.stdout.write("%-26s %s" % (key, results[key]))
@@ -1,15 +1,31 @@
-import re, logging
+import re, json, logging, signal, threading
 from datetime import datetime, date, timedelta, time
 from calendar import isleap
+from optparse import make_option
+from Queue import Queue, Empty
 
-from django.db import transaction
+from django.conf import settings
+from django.db import transaction, connections
 from django.core.management.base import BaseCommand, CommandError
 from django.template.defaultfilters import slugify
 from django.contrib.contenttypes.models import ContentType
 from libazpm.contrib.chronologia.models import Service, Series, Season, Episode, Air
 from protrack.db import Session
-from protrack.db.static_query import airs_sql, safe_airs_sql, program_sql, description_sql, series_sql
-from protrack.titlecase import titlecase
+from protrack.db.delta import server_time, changed_air_dates, changed_descriptions, date_ranges, each_day, split_range
+from protrack.db.lookup import ProtrackLookup, chunked
+from protrack.cache import MetadataCache
+from protrack.db.records import BATCH_SIZE
+from protrack.db.extract import air_batches
+from protrack.db.models import Air13, SafeAir13
+from protrack.db.replay import Recording, RecordingSession, ReplaySession
+from protrack.models import LoadWatermark, LoadCheckpoint
+from protrack.stats import LoadStats, CountingSession, phase
+from protrack.transactions import BatchTransaction, close_connection, lock_records
+from protrack.schedule import rebuild_days
+from protrack.fingerprints import fingerprint, load_fingerprints, save_fingerprint, assign
+from protrack.leases import Heartbeat, claim, release, make_owner
+from protrack import staging, pipeline
+from protrack.titlecase import titlecase, capwords, set_acronyms
 
 import warnings
 warnings.filterwarnings("ignore") # protrack informix throws dumb _______ warnings we don't give a ____ about
@@ -30,145 +46,521 @@ def number_of_days(dt):
     else:
         return 31
         
-def get_protrack_description(session, series, program, version, enc_type='utf8'):
+#marks a protrack version we know has no Episode yet
+NEW_EPISODE = object()
+
+class IdentityMap(object):
     """
-    get an episode or series description
-    this is because of how protrack stores descriptions for everything in the same table
-    a series is program = -1, version = -1, with a series id
+    run scoped Series, Season and Episode instances
+
+    process_series/process_season/process_episode consult this first so every
+    series, season and episode is resolved, refreshed and saved at most once per
+    load, however often it airs
+
+    with several workers (shared) what's in the map is seen by all of them, so
+    a record is only put there once it's committed: a write to one is
+    committed (share()) before saved() hands it out, nobody builds on a row
+    another thread could still roll back.  A single worker leaves it to the
+    batch's commit
     """
-    params = {'series': series, 'program': program, 'version': version}
-    results = session.execute(description_sql, params).fetchall()
-    
-    return u" ".join(unicode(row.pde_text, enc_type, errors='ignore') for row in results if row.pde_text != None)
-    
-def process_series(session, protrack_id):
+    def __init__(self):
+        self.series = {} # protrack series id -> Series
+        self.seasons = {} # (protrack series id, season number) -> Season
+        self.episodes = {} # protrack version id -> Episode or NEW_EPISODE
+        self.processed = set() # protrack version ids process_episode has saved
+        self.fingerprints = {} # (kind, protrack key) -> digest the record was last written from, or None
+        self.rewritten = set() # (kind, protrack key) of every record written this load (or daemon cycle)
+        self.shared = False # several workers use the map at once
+
+        #workers loading services in parallel share the map, a lock per key keeps two channels
+        #airing the same series from both working it out, the records lock from both creating it
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        #what each thread saved since its last commit, forgotten again if that's rolled back,
+        #and how to commit the thread's transaction
+        self._local = threading.local()
+
+    def lock(self, *key):
+        """
+        the lock guarding a series, season or episode key
+        """
+        with self._locks_lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def _pending(self):
+        if not hasattr(self._local, 'pending'):
+            self._local.pending = []
+        return self._local.pending
+
+    def saved(self, kind, key, instance):
+        """
+        remember an instance the calling thread saved, kind is series, seasons or episodes
+        """
+        getattr(self, kind)[key] = instance
+        if kind == 'episodes':
+            self.processed.add(key)
+        self._pending().append((kind, key))
+
+    def bind(self, commit):
+        """
+        how share() commits the calling thread's work, None when it's left to autocommit
+        """
+        self._local.commit = commit
+
+    def share(self):
+        """
+        commit what the calling thread wrote so far when the map is shared, the
+        series, season or episode it just wrote has to exist for other threads
+        before they see it
+        """
+        commit = getattr(self._local, 'commit', None)
+        if self.shared and commit is not None:
+            commit()
+
+    def mark(self):
+        """
+        a point rolled_back can forget back to
+        """
+        return len(self._pending())
+
+    def lock_records(self):
+        """
+        lock_records() for the calling thread's transaction, once until it's committed or rolled back
+        """
+        if getattr(self._local, 'locked', None) is None:
+            lock_records()
+            self._local.locked = self.mark()
+
+    def committed(self):
+        """
+        the calling thread's saves are in the database for good
+        """
+        self._local.pending = []
+        self._local.locked = None
+
+    def rolled_back(self, mark = 0):
+        """
+        forget what the calling thread saved since mark, the next lookup reads the database again
+        """
+        #a lock taken after the savepoint went with it
+        locked = getattr(self._local, 'locked', None)
+        if locked is not None and locked >= mark:
+            self._local.locked = None
+        pending = self._pending()
+        for kind, key in pending[mark:]:
+            #rolled back fingerprints are read from the database again too
+            getattr(self, kind).pop(key, None)
+            if kind == 'episodes':
+                self.processed.discard(key)
+        del pending[mark:]
+
+    def fingerprint(self, kind, key):
+        """
+        the digest the kind (series, season or episode) with protrack key was last written from
+        """
+        if (kind, key) not in self.fingerprints:
+            self.fingerprints[(kind, key)] = load_fingerprints(kind, [key]).get(key)
+        return self.fingerprints[(kind, key)]
+
+    def written(self, kind, key, digest):
+        """
+        store the digest a record was just written from
+        """
+        self.lock_records()
+        save_fingerprint(kind, key, digest)
+        self.fingerprints[(kind, key)] = digest
+        self.rewritten.add((kind, key))
+        self._pending().append(('fingerprints', (kind, key)))
+
+    def new_cycle(self, prune = False):
+        """
+        let a daemon cycle process everything again, keeping the episodes already fetched
+        unless prune, then they're fetched (and fingerprints read) again as they air
+        """
+        self.series.clear()
+        self.seasons.clear()
+        self.processed.clear()
+        self.rewritten.clear()
+        if prune:
+            #between cycles no worker holds a key lock
+            self.episodes.clear()
+            self.fingerprints.clear()
+            with self._locks_lock:
+                self._locks.clear()
+
+    def rewrote(self, row, episode):
+        """
+        whether this load wrote the row's episode (an Episode), its season or its series
+        """
+        season = (row.series, episode.season.number) if episode.season_id else None
+        return (('episode', row.version) in self.rewritten or ('series', row.series) in self.rewritten
+            or ('season', season) in self.rewritten)
+
+    def resolve_episodes(self, versions, batch_size = 500):
+        """
+        fetch the Episodes for every version we haven't seen yet in as few queries as possible
+        """
+        missing = sorted(v for v in set(versions) if v not in self.episodes)
+        for chunk in chunked(missing, batch_size):
+            for episode in Episode.objects.using("default").select_related("season","series").filter(protrack_id__in = chunk):
+                self.episodes[episode.protrack_id] = episode
+            for version in chunk:
+                self.episodes.setdefault(version, NEW_EPISODE)
+            digests = load_fingerprints('episode', chunk, batch_size)
+            for version in chunk:
+                self.fingerprints.setdefault(('episode', version), digests.get(version))
+
+class _NoLock(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+def key_lock(identity, *key):
+    """
+    the identity map's lock for key, or a no-op without an identity map
+    """
+    if identity is None:
+        return _NoLock()
+    return identity.lock(*key)
+
+def records_lock(identity):
+    """
+    take the records lock until the caller's transaction ends, every series,
+    season and episode write is made holding it
+    """
+    if identity is None:
+        lock_records()
+    else:
+        identity.lock_records()
+
+def locked_pk(identity, queryset):
+    """
+    take the records lock and look queryset's record up again under it, its
+    pk if another loader created it since we looked, otherwise None
+    """
+    records_lock(identity)
+    #a locking read sees what was committed since, whatever the isolation level
+    found = list(queryset.select_for_update().values_list('pk', flat = True)[:1])
+    return found[0] if found else None
+
+def process_series(session, protrack_id, lookup = None, identity = None, stats = None):
     """
     process a series from Protrack with a description
     """
-    try:
-        series = Series.objects.using("default").get(protrack_id = protrack_id)
-    except Series.DoesNotExist:
-        series = Series()
+    with key_lock(identity, 'series', protrack_id):
+        if identity is not None and protrack_id in identity.series:
+            return identity.series[protrack_id]
+
+        lookup = lookup or ProtrackLookup(session)
+
+        try:
+            series = Series.objects.using("default").get(protrack_id = protrack_id)
+        except Series.DoesNotExist:
+            series = Series()
     
-    params = {'series': protrack_id}
-    results = session.execute(series_sql, params).fetchone()    
+        results = lookup.series_row(protrack_id)
+        description = lookup.description(protrack_id, -1, -1)
+
+        #nothing protrack has for the series changed since we last wrote it
+        digest = fingerprint(results.title, results.nola, description)
+        if identity is not None and series.pk and identity.fingerprint('series', protrack_id) == digest:
+            identity.saved('series', protrack_id, series)
+            return series
     
-    series.name = titlecase(re.sub('{[\w-]+}','',results.title)).replace("Bbc", "BBC").replace("Pbs","PBS")
-    series.keyname = slugify(u"%s" % unicode(series.name,"utf8", errors="ignore"))
-    series.protrack_id = protrack_id
-    series.nola = results.nola
-    series.description = get_protrack_description(session, protrack_id, -1, -1)
+        with phase(stats, 'titlecase'):
+            name = titlecase(re.sub('{[\w-]+}','',results.title))
+        changed = assign(series, {
+            'name': name,
+            'keyname': slugify(u"%s" % unicode(name,"utf8", errors="ignore")),
+            'protrack_id': protrack_id,
+            'nola': results.nola,
+            'description': description,
+        })
     
-    series.save(using="default")
+        if not series.pk:
+            #another loader could have created it since we looked, we overwrite theirs then
+            series.pk = locked_pk(identity, Series.objects.using("default").filter(protrack_id = protrack_id))
+            series.save(using="default")
+        elif changed:
+            records_lock(identity)
+            series.save(using="default", update_fields = changed)
+
+        if identity is not None:
+            identity.written('series', protrack_id, digest)
+            identity.share()
+            identity.saved('series', protrack_id, series)
     
-    return series
+        return series
 
-def process_season(session, series, season_number, total_shows, returns = True):
+def process_season(session, series, season_number, total_shows, returns = True, lookup = None, identity = None, stats = None):
     """
     process a season
-    this will always update a season instance and return it
+    this will update a season instance (once per run when given an identity map) and return it
     """
-    try:
-        season = Season.objects.using("default").get(number = int(season_number), series__protrack_id = series)
-    except Season.DoesNotExist:
-        season = Season()
+    key = (series, int(season_number))
+    with key_lock(identity, 'season', *key):
+        if identity is not None and key in identity.seasons:
+            return identity.seasons[key] if returns else True
+
+        try:
+            season = Season.objects.using("default").get(number = int(season_number), series__protrack_id = series)
+        except Season.DoesNotExist:
+            season = Season()
         
-    season.number = season_number
-    season.total = total_shows
-    season.series = process_series(session, series)
+        with phase(stats, 'series', u"series %s" % series):
+            parent = process_series(session, series, lookup = lookup, identity = identity, stats = stats)
+
+        digest = fingerprint(int(season_number), total_shows)
+        if identity is not None and season.pk and season.series_id == parent.pk and identity.fingerprint('season', key) == digest:
+            identity.saved('seasons', key, season)
+            return season if returns else True
+
+        changed = assign(season, {'number': season_number, 'total': total_shows})
+        if season.series_id != parent.pk:
+            changed.append('series')
+        season.series = parent
     
-    season.save(using="default")
+        if not season.pk:
+            season.pk = locked_pk(identity, Season.objects.using("default").filter(number = int(season_number),
+                series__protrack_id = series))
+            season.save(using="default")
+        elif changed:
+            records_lock(identity)
+            season.save(using="default", update_fields = changed)
+
+        if identity is not None:
+            identity.written('season', key, digest)
+            identity.share()
+            identity.saved('seasons', key, season)
     
-    if returns:
-        return season
-    else:
-        return True #signifies success
+        if returns:
+            return season
+        else:
+            return True #signifies success
     
-def process_episode(session, row, duration):      
+def process_episode(session, row, duration, lookup = None, identity = None, stats = None):
     """
     Process an episode updating descriptions if necessary, or creating a new one.
     
+    lookup is a ProtrackLookup that has (ideally) prefetched this row's program,
+    series and descriptions, without one everything is queried as we go.
+    identity is the run's IdentityMap, repeat airings of a version get the
+    episode it already processed. stats is the run's LoadStats.
+
     Returns a valid instance of libazpm.contrib.protrack.models.Episode
     """
-    try:
-        episode = Episode.objects.using("default").select_related("season","series").get(protrack_id = row.version)
-    except Episode.DoesNotExist:
-        created = True
-        episode = Episode()
-    else:
-        created = False
+    with key_lock(identity, 'episode', row.version):
+        if identity is not None and row.version in identity.processed:
+            return identity.episodes[row.version]
+
+        lookup = lookup or ProtrackLookup(session)
+
+        episode = identity.episodes.get(row.version) if identity is not None else None
+        if episode is None:
+            try:
+                episode = Episode.objects.using("default").select_related("season","series").get(protrack_id = row.version)
+            except Episode.DoesNotExist:
+                episode = NEW_EPISODE
+
+        if episode is NEW_EPISODE:
+            created = True
+            episode = Episode()
+        else:
+            created = False
     
-    if not created:
-        #update the descriptions
-        episode.short_description = unicode(row.short_description or "",'utf8')
-        episode.description = get_protrack_description(session, row.series, row.program, row.version)
-        #this triggers a process to update the series description
-        season = process_season(session, row.series, episode.season.number, episode.season.total)
-
-        if not episode.season_id:
-            episode.season = season
-        if not episode.series_id:
-            episode.series = season.series
-    else:
-        #attach some basic wording to the episode
-        episode.short_description = unicode(row.short_description or "",'utf8')
-        episode.description = get_protrack_description(session, row.series, row.program, row.version)
-        episode.protrack_id = row.version
-        episode.duration = duration
-        
-        params = {'program': row.program}
-        results = session.execute(program_sql, params).fetchone()
-        
-        #process the episode title, set it to nothing there isn't a title
-        if str(results.title).upper() == "NONE" or results.title == None:
-            episode.name = None
+        description = lookup.description(row.series, row.program, row.version)
+        digest = fingerprint(row.short_description, description)
+
+        if not created:
+            #this triggers a process to update the series description
+            with phase(stats, 'season'):
+                season = process_season(session, row.series, episode.season.number, episode.season.total, lookup = lookup, identity = identity, stats = stats)
+
+            #update the descriptions, if protrack changed them
+            changed = []
+            if identity is None or identity.fingerprint('episode', row.version) != digest:
+                changed = assign(episode, {
+                    'short_description': unicode(row.short_description or "",'utf8'),
+                    'description': description,
+                })
+            if not episode.season_id:
+                episode.season = season
+                changed.append('season')
+            if not episode.series_id:
+                episode.series = season.series
+                changed.append('series')
+
+            if changed:
+                records_lock(identity)
+                episode.save(using="default", update_fields = changed)
+            wrote = bool(changed)
         else:
-            episode.name = str(results.title).title().replace('Bbc', 'BBC').replace("Bbq","BBQ").replace("'S","'s").replace("'T","'t").strip()
+            #attach some basic wording to the episode
+            episode.short_description = unicode(row.short_description or "",'utf8')
+            episode.description = description
+            episode.protrack_id = row.version
+            episode.duration = duration
         
-        #slurp out the entire nola code for breaking it down
-        full_nola_code = results.nola_code
+            results = lookup.program(row.program)
         
-        #before any nola processing, we should apply the nola to the episode
-        episode.full_nola = full_nola_code
-        
-        #start working on numbers & season information
-        episode.number = results.number
+            #process the episode title, set it to nothing there isn't a title
+            if str(results.title).upper() == "NONE" or results.title == None:
+                episode.name = None
+            else:
+                with phase(stats, 'titlecase'):
+                    episode.name = capwords(str(results.title)).strip()
         
-        #get the season information from the nola code
-        season_number = "%s" % (full_nola_code[6:])
+            #before any nola processing, we should apply the nola to the episode
+            episode.full_nola = results.nola_code
         
-        #process the nola code for HD information and reset the season_number
-        nola_code_modifier = None
-        if len(season_number) > 6:
-            nola_code_modifier = season_number[6:]
-            season_number = season_number[0:6]
+            #start working on numbers & season information
+            episode.number = results.number
         
-        if nola_code_modifier is 'H' or nola_code_modifier is 'Z':
-            episode.high_definition = True
-        else:
-            episode.high_definition = False
+            #the season and HD information are in the nola code
+            nola = lookup.nola(row.program)
+            episode.high_definition = nola.hd
         
-        #when there is season information we must work on it
-        if season_number is not "000000":
-            if episode.number >= 100:
-                season_number = season_number[0:(len(season_number)-3)]
-            else:
-                season_number = season_number[0:(len(season_number)-2)]
-            
-            season = process_season(session, row.series, int(season_number), results.total)
+            #every nola carries a season, even if it's 000000
+            with phase(stats, 'season'):
+                season = process_season(session, row.series, nola.season_number, results.total, lookup = lookup, identity = identity, stats = stats)
             
             episode.season = season
             episode.series = season.series
      
-    #always save our work
-    episode.save(using="default")
-    return episode
+            episode.pk = locked_pk(identity, Episode.objects.using("default").filter(protrack_id = row.version))
+            episode.save(using="default")
+            wrote = True
+
+        if identity is not None:
+            if identity.fingerprint('episode', row.version) != digest:
+                identity.written('episode', row.version, digest)
+                wrote = True
+            if wrote:
+                identity.rewritten.add(('episode', row.version))
+                identity.share()
+            identity.saved('episodes', row.version, episode)
+
+        return episode
+
+def air_key(air):
+    """
+    the columns that make two airs of a service the same air
+    """
+    return (air.airing_type_id, air.airing_id, air.date, air.time, air.duration)
+
+def reconcile_airs(service, airs, start, end = None, batch_size = 500, spare = ()):
+    """
+    make the service's airs from start to end (open ended without one) match airs,
+    a list of unsaved Air instances, touching only the rows that differ
+
+    airs are never deleted from dates in spare, the days with rows we skipped
+
+    returns a (created, updated, deleted, dates) tuple, the counts and the dates
+    any of them were on
+    """
+    existing = Air.objects.using("default").filter(service = service, date__gte = start)
+    if end is not None:
+        existing = existing.filter(date__lte = end)
+
+    current = {}
+    for pk, airing_type_id, airing_id, on_date, at_time, duration, starts, ends in existing.values_list(
+            'pk', 'airing_type', 'airing_id', 'date', 'time', 'duration', 'start', 'end'):
+        current.setdefault((airing_type_id, airing_id, on_date, at_time, duration), []).append((pk, starts, ends))
+
+    to_create = []
+    to_update = []
+    dates = set()
+    seen = set()
+    for air in airs:
+        key = air_key(air)
+        if key in seen:
+            continue # protrack repeats rows, get_or_create used to swallow these
+        seen.add(key)
+
+        if key in current:
+            pk, starts, ends = current[key].pop()
+            if not current[key]:
+                del current[key]
+            if (starts, ends) != (air.start, air.end):
+                to_update.append((pk, air.start, air.end))
+                dates.add(air.date)
+        else:
+            to_create.append(air)
+
+    #whatever wasn't matched (including duplicate rows in our db) is gone from protrack
+    stale = [pk for key, matches in current.items() if key[2] not in spare for pk, starts, ends in matches]
+    dates.update(key[2] for key in current if key[2] not in spare)
+    dates.update(air.date for air in to_create)
+
+    with transaction.commit_on_success(using = "default"):
+        for chunk in chunked(stale, batch_size):
+            Air.objects.using("default").filter(pk__in = chunk).delete()
+        for pk, starts, ends in to_update:
+            Air.objects.using("default").filter(pk = pk).update(start = starts, end = ends)
+        Air.objects.using("default").bulk_create(to_create, batch_size = batch_size)
+
+    return len(to_create), len(to_update), len(stale), dates
 
 class Command(BaseCommand):
     args = '<service_keyname service_keyname ...>'
     help = 'Load Schedule Data for given or all service'
+    option_list = BaseCommand.option_list + (
+        make_option('--reconcile', action = 'store_true', dest = 'reconcile', default = False,
+            help = 'Diff airs against protrack and write only the changes instead of deleting all future airs'),
+        make_option('--incremental', action = 'store_true', dest = 'incremental', default = False,
+            help = 'Only reload air dates changed in protrack since the last load (implies --reconcile)'),
+        make_option('--batch-size', type = 'int', dest = 'batch_size', default = BATCH_SIZE,
+            help = 'Air rows fetched from protrack (and prefetched for) at a time'),
+        make_option('--commit-every', type = 'int', dest = 'commit_every', default = 1000,
+            help = 'Commit every N airs, each air is rolled back and skipped on its own if it fails'),
+        make_option('--workers', type = 'int', dest = 'workers', default = 1,
+            help = 'Load this many services in parallel, each with its own protrack and database connection'),
+        make_option('--record', dest = 'record', metavar = 'PATH',
+            help = 'Save every protrack result the load reads to PATH'),
+        make_option('--replay', dest = 'replay', metavar = 'PATH',
+            help = 'Serve protrack results from a --record file instead of informix'),
+        make_option('--stats-file', dest = 'stats_file', metavar = 'PATH',
+            help = 'Write per phase and per service timings and query counts to PATH as JSON'),
+        make_option('--horizon', type = 'int', dest = 'horizon', default = 21,
+            help = 'Load airs this many days ahead of today'),
+        make_option('--chunk-days', type = 'int', dest = 'chunk_days', default = 7,
+            help = 'Days of airs loaded and committed per checkpointed unit'),
+        make_option('--resume', action = 'store_true', dest = 'resume', default = False,
+            help = "Only load the units today's interrupted load of each service didn't finish"),
+        make_option('--daemon', action = 'store_true', dest = 'daemon', default = False,
+            help = 'Keep running, loading what protrack changed every --interval seconds (implies --incremental)'),
+        make_option('--interval', type = 'int', dest = 'interval', default = 300,
+            help = 'Seconds between --daemon cycles'),
+        make_option('--full-every', type = 'int', dest = 'full_every', default = 12, metavar = 'N',
+            help = 'Reconcile the whole horizon every Nth --daemon cycle and on the first after midnight, 0 for midnight only'),
+        make_option('--no-schedule', action = 'store_false', dest = 'schedule', default = True,
+            help = "Don't rebuild the flattened per day schedules of the days loaded"),
+        make_option('--no-cache', action = 'store_true', dest = 'no_cache', default = False,
+            help = 'Neither read nor update the program, series and description cache kept between loads'),
+        make_option('--lease-ttl', type = 'int', dest = 'lease_ttl', default = 300,
+            help = 'Seconds a service stays claimed by this loader without a heartbeat'),
+        make_option('--staging', action = 'store_true', dest = 'staging', default = False,
+            help = 'Unload each unit into staging tables and derive series, episodes and airs there with set-based SQL'),
+        make_option('--pipeline', type = 'int', dest = 'pipeline', default = 0, metavar = 'N',
+            help = 'Extract airs on a thread and protrack connection of their own, up to N batches ahead of the writes'),
+    )
 
-    def handle(self, *args, **options):        
+    @property
+    def session(self):
+        return self.local.session
+
+    @property
+    def lookup(self):
+        return self.local.lookup
+
+    def setup(self, args, options, cache = True):
+        """
+        the services named in args, every protrack service without any, and
+        what loads and backfills share set up from options, cache = False
+        leaves the metadata cache out whatever --no-cache says
+        """
         services = []
         for keyname in args:
             try:
@@ -183,83 +575,562 @@ class Command(BaseCommand):
         
         if not services:
             raise CommandError('There are no services!')
-        
-        logger.info("Started protrack load for: {0:>s}".format(", ".join(service.name for service in services)))
-        #date handling for today and arbritray date in future
-        today = date.today()
+
+        if getattr(settings, 'PROTRACK_ACRONYMS', None):
+            set_acronyms(settings.PROTRACK_ACRONYMS)
+
+        self.cache = None
+        if cache and not options.get('no_cache'):
+            self.cache = MetadataCache(timedelta(days = getattr(settings, 'PROTRACK_CACHE_TTL', 7)))
+
+        self.stats = LoadStats()
+        self.local = threading.local()
+        self.identity = IdentityMap()
+        self.batch_size = options.get('batch_size') or BATCH_SIZE
+        self.commit_every = options.get('commit_every') or 1000
+        self.schedule = options.get('schedule', True)
+        self.pipeline = max(0, options.get('pipeline') or 0)
+        self.ct = ContentType.objects.get_for_model(Episode)
+        return services
+
+    def refresh_cache(self):
+        """
+        drop what protrack changed from the metadata cache, on the calling worker's session
+        """
+        if self.cache is not None:
+            with phase(self.stats, 'cache refresh'):
+                stale = self.cache.refresh(self.session)
+            logger.info("dropped %d changed descriptions from the protrack cache." % stale)
+
+    def open_session(self):
+        """
+        a new protrack session, replayed or recorded when asked to
+        """
+        if self.replaying is not None:
+            return ReplaySession(self.replaying)
+        elif self.recording is not None:
+            return RecordingSession(Session(), self.recording)
+        return Session()
+
+    def start_worker(self):
+        """
+        give the calling thread its own protrack session and lookup cache
+        """
+        self.stats.start_thread(connections["default"])
+        self.local.session = CountingSession(self.open_session(), self.stats)
+        self.local.lookup = ProtrackLookup(self.local.session, cache = self.cache)
+
+    def stop_worker(self):
+        """
+        end the calling thread's protrack session
+        """
+        self.local.session.close()
+        self.stats.stop_thread(connections["default"])
+
+    def extract(self, model, service, start, end):
+        """
+        stream a service's airs out of model (Air13 or SafeAir13) in batches with
+        their programs, series and descriptions prefetched, on another thread and
+        protrack session given --pipeline
+        """
+        if self.pipeline:
+            return pipeline.extract(CountingSession(self.open_session(), self.stats), self.lookup, self.stats,
+                model, service, start, end, self.batch_size, self.pipeline)
+        return self.prefetched(air_batches(self.session, model, service.protrack_key, start, end, self.batch_size))
+
+    def prefetched(self, batches):
+        while True:
+            with phase(self.stats, 'extraction'):
+                rows = next(batches, None)
+            if rows is None:
+                break
+
+            with phase(self.stats, 'description fetch'):
+                self.lookup.prefetch(rows)
+            yield rows
+
+    def fetch_airs(self, model, service, start, end):
+        """
+        stream a service's airs out of model (Air13 or SafeAir13) in batches, prefetching everything each batch needs
+        """
+        for rows in self.extract(model, service, start, end):
+            with phase(self.stats, 'episode fetch'):
+                self.identity.resolve_episodes(row.version for row in rows)
+            yield rows
+
+    def process_airs(self, service, batches, batch, keep_to = None):
+        """
+        turn batches of air rows into episodes and airs for service, each row
+        under a savepoint of batch, a BatchTransaction
+
+        when reconciling nothing is written, the airs dated up to keep_to are
+        returned for reconcile_airs instead
+
+        returns a (number of rows, airs, dates with skipped rows, dates of rows
+        whose episode, season or series this load wrote) tuple
+        """
+        counter = 0
+        airs = []
+        skipped = set()
+        touched = set()
+        for row in (row for rows in batches for row in rows):
+            label = u"%s %s %s version %s" % (service.keyname, row.airdate, row.airtime, row.version)
+            before = batch.skipped
+            with batch.row(label):
+                #process episode, times were decoded with the batch
+                with phase(self.stats, 'episode', label):
+                    ep = process_episode(self.session, row, row.duration, lookup = self.lookup, identity = self.identity, stats = self.stats)
+                if self.identity.rewrote(row, ep):
+                    touched.add(row.airdate)
+                #get/create the air
+                if self.reconcile:
+                    if keep_to is None or row.airdate <= keep_to:
+                        airs.append(Air(service = service, airing_type = self.ct, airing_id = ep.pk, date = row.airdate, duration = row.duration, time = row.time, start = row.start, end = row.end))
+                else:
+                    with phase(self.stats, 'air writes'):
+                        air, created = Air.objects.using("default").get_or_create(service = service, airing_type = self.ct, airing_id = ep.pk, date = row.airdate, duration = row.duration, time = row.time, start = row.start, end = row.end)
+            if batch.skipped > before:
+                skipped.add(row.airdate)
+            counter += 1
+
+        return counter, airs, skipped, touched
+
+    def load_future(self, service, start, end, batch, keep_to = None):
+        """
+        load the future airs between start and end, reconciling start to keep_to
+
+        returns the dates whose schedules changed when reconciling (None
+        otherwise) and the dates with skipped rows
+        """
+        counter, airs, skipped, touched = self.process_airs(service, self.fetch_airs(Air13, service, start, end), batch)
+        logger.info("found %d airs for %s from %s to %s." % (counter, service.name, start, end))
+
+        if self.reconcile:
+            with phase(self.stats, 'air writes'):
+                changes = reconcile_airs(service, airs, start, keep_to, spare = skipped)
+            logger.info("airs for %s: %d created, %d updated, %d deleted." % ((service.name,) + changes[:3]))
+            return changes[3] | touched, skipped
+        return None, skipped
+
+    def load_staged(self, model, service, start, end, batch, open_ended = False):
+        """
+        stage the airs between start and end out of model (Air13 or SafeAir13)
+        and derive the service's series, episodes and airs from them, reconciling
+        start to end (or on, open_ended) the way --reconcile does
+
+        returns the dates whose schedules changed and the dates with skipped rows
+        """
+        with phase(self.stats, 'extraction'):
+            counter, skipped = staging.unload(service, self.extract(model, service, start, end), self.lookup,
+                self.batch_size, self.stats)
+        logger.info("staged %d airs for %s from %s to %s." % (counter, service.name, start, end))
+
+        with staging.deriving:
+            with phase(self.stats, 'staging'):
+                changes = staging.derive(service, self.ct, start, None if open_ended else end, skipped, self.batch_size)
+            #other workers deriving next have to see what this one created
+            batch.commit()
+        logger.info("airs for %s: %d created, %d updated, %d deleted." % ((service.name,) + changes[:3]))
+        return changes[3], skipped
+
+    def load_service(self, service):
+        """
+        load the backlog (if needed) and future airs of a service
+        """
+        today = self.today
         first_of_month = date(today.year, today.month, 1)
         last_of_month = date(today.year, today.month, number_of_days(today))
-        two_weeks_ahead = timedelta(days = 14)
-        two_weeks_ahead = today+two_weeks_ahead
-        three_wks_ahead = timedelta(days = 21)
-        three_wks_ahead = today+three_wks_ahead
-        one_month_ahead = timedelta(days = 31)
-        one_month_ahead = today+one_month_ahead
-        
-        # start a protrack session
-        session = Session()
-        
-        services_processed = 0
-        
-        ct = ContentType.objects.get_for_model(Episode)
 
-        with transaction.commit_on_success():
-            if today != first_of_month:
-                # if today is not the first of the month, delete everything from today forward
-                logger.info("deleting all future airs for: {0:>s}".format(" ".join(t.keyname for t in services)))
-                Air.objects.using("default").filter(service__in=services, date__gte=today).delete()
+        #future airs are replaced unit by unit below, so only the ones before today count
+        if self.delete_future:
+            last_of_month = today - timedelta(days = 1)
+
+        #the days whose airs (or their episodes) this load changed, their schedules get rebuilt
+        days = set()
+        #the days from today on with rows that failed, the next incremental load does them again
+        skipped = set()
+
+        #special case where we have nothing in the DB for this month
+        if not Air.objects.using("default").filter(service=service, date__range=(first_of_month, last_of_month)).exists():
+            logger.info("no airs exist for %s in %d/%d" % (service.name, first_of_month.month, first_of_month.year))
+
+            if self.staging:
+                if today > first_of_month:
+                    with self.batch_transaction() as batch:
+                        days.update(self.load_staged(SafeAir13, service, first_of_month, today - timedelta(days = 1),
+                            batch)[0])
+            else:
+                batches = self.fetch_airs(SafeAir13, service, first_of_month, today)
+                with self.batch_transaction() as batch:
+                    #today belongs to the future airs below
+                    counter, airs, skipped, touched = self.process_airs(service, batches, batch, keep_to = today - timedelta(days = 1))
+                logger.info("found %d backlog airs for %s." % (counter, service.name))
+
+                if self.reconcile:
+                    with phase(self.stats, 'air writes'):
+                        changes = reconcile_airs(service, airs, first_of_month, today - timedelta(days = 1), spare = skipped)
+                    logger.info("backlog airs for %s: %d created, %d updated, %d deleted." % ((service.name,) + changes[:3]))
+                    days.update(changes[3] | touched)
+                else:
+                    days.update(each_day(first_of_month, today - timedelta(days = 1)))
+
+        run = self.resume and self.incomplete_run(service)
+        if run:
+            checkpoints = [c for c in run if c.completed is None]
+            logger.info("resuming the load of %s started %s, %d of %d units left." % (
+                service.name, run[0].run, len(checkpoints), len(run)))
+        else:
+            run = checkpoints = self.plan_units(service)
 
+        for checkpoint in checkpoints:
+            self.check_lease(service)
+            #commits as it goes, the checkpoint only with the unit's last airs so an interrupted unit is redone
+            with self.batch_transaction() as batch:
+                if self.delete_future:
+                    airs = Air.objects.using("default").filter(service = service, date__gte = checkpoint.start)
+                    if not checkpoint.open_ended:
+                        airs = airs.filter(date__lte = checkpoint.end)
+                    with phase(self.stats, 'air writes'):
+                        airs.delete()
 
-        for service in services:
-            #special case where we have nothing in the DB for this month
-            if not Air.objects.using("default").filter(service=service, date__range=(first_of_month, last_of_month)).exists():
-                logger.info("no airs exist for %s in %d/%d" % (service.name, first_of_month.month, first_of_month.year))
+                if self.staging:
+                    changed, failed = self.load_staged(Air13, service, checkpoint.start, checkpoint.end, batch,
+                        open_ended = checkpoint.open_ended)
+                else:
+                    changed, failed = self.load_future(service, checkpoint.start, checkpoint.end, batch,
+                        keep_to = None if checkpoint.open_ended else checkpoint.end)
 
-                params = {'start': first_of_month, 'end': today, 'channel_key': service.protrack_key}
-                results = session.execute(safe_airs_sql, params)
-                counter = 0
+                checkpoint.completed = datetime.now()
+                checkpoint.save(using = "default")
+            #the unit's airs were deleted and written again, or (without --reconcile) just written
+            if self.delete_future or changed is None:
+                changed = each_day(checkpoint.start, checkpoint.end)
+            days.update(changed)
+            skipped.update(failed)
+
+        self.check_lease(service)
+        if self.schedule and days:
+            with phase(self.stats, 'schedule'):
                 with transaction.commit_on_success():
-                    for row in results.fetchall():
-                        #process into timestamps
-                        t = time(int(row.airtime[0:2]),int(row.airtime[3:5]),int(row.airtime[6:8]))
-                        length = time(int(row.length[0:2]),int(row.length[3:5]),int(row.length[6:8]))
-                        start = datetime.combine(row.airdate, t)
-                        end = datetime.combine(row.airdate, t) + timedelta(hours=length.hour, minutes=length.minute, seconds=length.second)
-                        #make episode
-                        ep = process_episode(session, row, length)
-                        #get/create the air
-                        air, created = Air.objects.using("default").get_or_create(service = service, airing_type = ct, airing_id = ep.pk, date = row.airdate, duration = length, time = t, start = start, end = end)
-                        counter += 1
-                    else:
-                        logger.info("found %d backlog airs for %s." % (counter, service.name))
-
-            #regular case to get things into the future
-            params = {'start': today, 'end': three_wks_ahead, 'channel_key': service.protrack_key}
-            results = session.execute(airs_sql, params)
-            counter = 0
-
-
-            for row in results.fetchall():
-                #process into timestamps
-                t = time(int(row.airtime[0:2]),int(row.airtime[3:5]),int(row.airtime[6:8]))
-                length = time(int(row.length[0:2]),int(row.length[3:5]),int(row.length[6:8]))
-                start = datetime.combine(row.airdate, t)
-                end = datetime.combine(row.airdate, t) + timedelta(hours=length.hour, minutes=length.minute, seconds=length.second)
-                #process episode
-                ep = process_episode(session, row, length)
-                #get/create the air
-                air, created = Air.objects.using("default").get_or_create(service = service, airing_type = ct, airing_id = ep.pk, date = row.airdate, duration = length, time = t, start = start, end = end)
-                counter += 1
+                    count = rebuild_days(service, days, self.batch_size)
+            logger.info("rebuilt %d schedule days (%d airs) for %s." % (len(days), count, service.name))
+
+        if self.incremental:
+            try:
+                watermark = LoadWatermark.objects.using("default").get(service = service)
+            except LoadWatermark.DoesNotExist:
+                watermark = LoadWatermark(service = service)
+            #a resumed run only saw changes up to when it first started
+            watermark.up_date = (run[0].up_date if run else None) or self.load_started
+            watermark.horizon = max([c.end for c in run] + [watermark.horizon or self.today])
+            #this run planned the last one's retry dates again (or the whole window), so its own replace them
+            watermark.retry = json.dumps(sorted(day.isoformat() for day in skipped))
+            if skipped:
+                logger.info("%d days of %s had skipped rows, the next load retries them." % (len(skipped), service.name))
+            watermark.save(using = "default")
+
+        logger.info("finished processing %s." % service.name)
+
+    def load_leased(self, service):
+        """
+        load a service under its lease, returns False without loading it if another loader holds it
+        """
+        if not claim(service, self.heartbeat.owner, self.heartbeat.ttl):
+            logger.info("%s is being loaded elsewhere, skipping it." % service.name)
+            return False
+
+        self.heartbeat.hold(service)
+        try:
+            self.load_service(service)
+        finally:
+            self.heartbeat.drop(service)
+            release(service, self.heartbeat.owner)
+        return True
+
+    def check_lease(self, service):
+        """
+        stop loading service (LeaseLost) if its lease went to another loader
+        """
+        self.heartbeat.check(service)
+
+    def batch_transaction(self):
+        """
+        a transaction committing every commit_every airs
+        """
+        return BatchTransaction(self.commit_every, identity = self.identity, stats = self.stats)
+
+    def plan_units(self, service):
+        """
+        split the days to load for service into checkpointed units of chunk_days
+        """
+        today = self.today
+        ranges = [(today, self.horizon, True)]
+        #a full cycle reconciles the whole window, up_date misses airs protrack moved or deleted
+        if self.incremental and not self.full_cycle:
+            try:
+                watermark = LoadWatermark.objects.using("default").get(service = service)
+            except LoadWatermark.DoesNotExist:
+                pass
             else:
-                logger.info("found %d airs for %s." % (counter, service.name))
+                #regular case, only the days protrack changed plus the ones new to the horizon
+                with phase(self.stats, 'extraction'):
+                    dates = changed_air_dates(self.session, service.protrack_key, today, self.horizon, watermark.up_date)
+                #and the ones it skipped rows on
+                dates.update(day for day in watermark.retry_dates if today <= day <= self.horizon)
+                day = max(today, watermark.horizon + timedelta(days = 1))
+                while day <= self.horizon:
+                    dates.add(day)
+                    day += timedelta(days = 1)
+                logger.info("%d changed air dates for %s since %s." % (len(dates), service.name, watermark.up_date))
+                ranges = [(start, end, False) for start, end in date_ranges(dates)]
 
+        checkpoints = []
+        for start, end, open_ended in ranges:
+            chunks = split_range(start, end, self.chunk_days)
+            for first, last in chunks:
+                checkpoints.append(LoadCheckpoint(service = service, run = self.started, up_date = self.load_started,
+                    start = first, end = last, open_ended = open_ended and (first, last) == chunks[-1]))
+
+        with transaction.commit_on_success():
+            LoadCheckpoint.objects.using("default").filter(service = service).delete()
+            for checkpoint in checkpoints:
+                checkpoint.save(using = "default")
+
+        return checkpoints
+
+    def incomplete_run(self, service):
+        """
+        the checkpoints of the service's last load if it was today and didn't finish, otherwise None
+        """
+        last = LoadCheckpoint.objects.using("default").filter(service = service,
+            run__gte = datetime.combine(self.today, time())).order_by('-run')[:1]
+        if not last:
+            return None
+
+        run = list(LoadCheckpoint.objects.using("default").filter(service = service, run = last[0].run).order_by('start'))
+        if all(c.completed is not None for c in run):
+            return None
+        return run
+
+    def load_one(self, service, failures):
+        """
+        load service, logging it and adding it to failures if it fails (a lost lease included)
+        so the other services still get loaded
+        """
+        try:
+            self.stats.service(service.keyname)
+            with phase(self.stats, 'load'):
+                self.load_leased(service)
+        except Exception:
+            logger.exception("failed loading %s." % service.name)
+            failures.append(service)
+
+    def work(self, services, failures):
+        """
+        worker thread body, loads services off the queue until it's empty
+        """
+        self.start_worker()
+        try:
+            while True:
+                try:
+                    service = services.get_nowait()
+                except Empty:
+                    break
+
+                self.load_one(service, failures)
+        finally:
+            self.stop_worker()
+            close_connection()
+
+    def start_cycle(self):
+        """
+        date the load (or the daemon's next cycle) from now, a replay from when it was recorded
+        """
+        #date handling for today and arbritray date in future
+        if self.replaying is not None:
+            self.today = today = self.replaying.run['today']
+        else:
+            self.today = today = date.today()
+        if self.recording is not None:
+            self.recording.run['today'] = today
+        first_of_month = date(today.year, today.month, 1)
+        self.started = datetime.now()
+        self.horizon = today + timedelta(days = self.horizon_days)
+
+        self.load_started = None
+        if self.incremental:
+            #stamp before we read anything so changes made during the load are seen next time
+            self.load_started = server_time(self.session)
+
+        # if today is not the first of the month, every future air is replaced, a unit at a time
+        self.delete_future = today != first_of_month and not self.reconcile
+
+    def load_services(self, services, workers = 1):
+        """
+        load services, workers at a time, returning the ones that failed
+        """
+        failures = []
+        if workers > 1:
+            queue = Queue()
+            for service in services:
+                queue.put(service)
+
+            threads = [threading.Thread(target = self.work, args = (queue, failures)) for i in range(min(workers, len(services)))]
+            self.identity.shared = len(threads) > 1
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        else:
+            for service in services:
+                self.load_one(service, failures)
+
+        return failures
+
+    def daemon(self, services, interval, stats_file = None, full_every = 0):
+        """
+        poll protrack every interval seconds and load what changed, until SIGTERM or SIGINT
+
+        up_date doesn't tell us about airs protrack moved off a date or deleted,
+        so every full_every-th cycle, and the first of each day, reconciles the
+        whole window like a --reconcile run
+
+        the protrack session, lookup cache and identity map stay warm between
+        cycles, only what protrack says changed is dropped from them. Each
+        cycle's stats are logged and, given a stats_file, written over it
+        """
+        stopping = threading.Event()
+        def stop(signum, frame):
+            logger.info("caught signal %d, stopping after this cycle." % signum)
+            stopping.set()
+        handlers = dict((signum, signal.signal(signum, stop)) for signum in (signal.SIGTERM, signal.SIGINT))
+
+        ttl = self.cache.ttl if self.cache is not None else timedelta(days = getattr(settings, 'PROTRACK_CACHE_TTL', 7))
+        rows_loaded = datetime.now()
+        cycle = 0
+        last_day = None
+        try:
+            while not stopping.is_set():
+                cycle += 1
+                self.stats.reset()
+                failures = []
+                self.full_cycle = bool(full_every and cycle % full_every == 0) or (
+                    last_day is not None and date.today() != last_day)
+                if self.full_cycle:
+                    logger.info("protrack cycle %d reconciles the whole horizon." % cycle)
+                try:
+                    expired = False
+                    if cycle > 1:
+                        #drop what protrack changed since the last cycle started, program and series rows by age
+                        with phase(self.stats, 'cache refresh'):
+                            expired = datetime.now() - rows_loaded > ttl
+                            self.lookup.forget(changed_descriptions(self.session, self.load_started), rows = expired)
+                            if expired:
+                                rows_loaded = datetime.now()
+                            if self.cache is not None:
+                                self.cache.refresh(self.session)
+                    #with the program and series rows, so the map stays as big as a day's airs
+                    self.identity.new_cycle(prune = expired)
+                    self.start_cycle()
+                    last_day = self.today
+                    failures = self.load_services(services)
+                except Exception:
+                    logger.exception("protrack cycle %d failed." % cycle)
+                    failures = services
+
+                if failures:
+                    #whatever went wrong may have taken the protrack connection with it
+                    self.stop_worker()
+                    self.start_worker()
+
+                summary = self.stats.summary()
+                summary.update(cycle = cycle, full = self.full_cycle, failed = [t.keyname for t in failures])
+                logger.info("protrack cycle %d stats: %s" % (cycle, json.dumps(summary, sort_keys = True)))
+                if stats_file:
+                    with open(stats_file, 'w') as out:
+                        json.dump(summary, out, sort_keys = True, indent = 2)
+
+                #don't hold a database connection while we sleep
+                close_connection()
+                stopping.wait(interval)
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+
+        logger.info("protrack daemon stopped after %d cycles." % cycle)
+
+    def handle(self, *args, **options):        
+        self.resume = options.get('resume', False)
+        if options.get('record') and options.get('replay'):
+            raise CommandError('--record and --replay are exclusive')
+        daemon = options.get('daemon', False)
+        if daemon and (options.get('record') or options.get('replay') or self.resume):
+            raise CommandError('--daemon can not be combined with --record, --replay or --resume')
+        self.recording = Recording() if options.get('record') else None
+        self.replaying = Recording.load(options['replay']) if options.get('replay') else None
+
+        #recordings and replays have to ask protrack the same things every time, so no cache for them
+        services = self.setup(args, options, cache = self.recording is None and self.replaying is None)
+
+        logger.info("Started protrack load for: {0:>s}".format(", ".join(service.name for service in services)))
+        self.horizon_days = options.get('horizon') or 21
+        self.chunk_days = max(1, options.get('chunk_days') or 7)
+
+        # start a protrack session
+        self.start_worker()
+        self.refresh_cache()
+        self.staging = options.get('staging', False)
+        self.full_cycle = False
+
+        #the options that decide which queries a load asks, a replay asks what the recording did
+        if self.replaying is not None:
+            run = self.replaying.run
+            self.horizon_days, self.chunk_days = run['horizon'], run['chunk_days']
+            self.batch_size, self.pipeline = run['batch_size'], run['pipeline']
+            logger.info("replaying a load recorded for %s." % run['today'])
+        elif self.recording is not None:
+            self.recording.run.update(horizon = self.horizon_days, chunk_days = self.chunk_days,
+                batch_size = self.batch_size, pipeline = self.pipeline)
+        workers = max(1, options.get('workers') or 1)
+
+        self.incremental = options.get('incremental', False) or daemon
+        self.reconcile = options.get('reconcile', False) or self.incremental
+
+        #services are claimed one at a time, loaders on other hosts take the rest
+        self.heartbeat = Heartbeat(make_owner(), timedelta(seconds = max(30, options.get('lease_ttl') or 300)))
+        self.heartbeat.start()
+
+        if daemon:
+            if workers > 1:
+                logger.info("--daemon cycles are small, loading them on one warm session rather than %d workers." % workers)
+            try:
+                self.daemon(services, max(1, options.get('interval') or 300), options.get('stats_file'),
+                    max(0, options.get('full_every', 12) or 0))
+            finally:
+                self.heartbeat.stop()
+                self.stop_worker()
+            return
+
+        try:
+            self.start_cycle()
+            failures = self.load_services(services, workers)
+        finally:
+            self.heartbeat.stop()
 
-            logger.info("finished processing %s." % service.name)
-            services_processed += 1
-            
         #end the protrack session                                    
-        session.close()
+        self.stop_worker()
+
+        if self.recording is not None:
+            self.recording.save(options['record'])
+            logger.info("recorded %d protrack results to %s" % (len(self.recording.results), options['record']))
+
+        summary = self.stats.summary()
+        logger.info("protrack load stats: %s" % json.dumps(summary, sort_keys = True))
+        if options.get('stats_file'):
+            with open(options['stats_file'], 'w') as stats_file:
+                json.dump(summary, stats_file, sort_keys = True, indent = 2)
+
+        if failures:
+            raise CommandError('Failed loading: %s' % ", ".join(t.keyname for t in failures))
         
         logger.info(u"Completed protrack load for: {0:>s}".format(" ".join(t.keyname for t in services)))
-
-           
\ No newline at end of file
@@ -0,0 +1,192 @@
+import json
+from datetime import datetime
+
+from django.db import models
+from libazpm.contrib.chronologia.models import Service
+
+class LoadWatermark(models.Model):
+    """
+    where the last successful load of a service left off
+
+    up_date is protrack's server time when that load started, anything
+    changed after it gets picked up by the next incremental load, and so
+    are the retry dates, the days that load skipped rows on
+    """
+    service = models.OneToOneField(Service, related_name = 'protrack_watermark')
+    up_date = models.DateTimeField()
+    horizon = models.DateField(help_text = "last air date the load covered")
+    retry = models.TextField(default = "[]", help_text = "json list of the dates the load skipped rows on")
+    loaded = models.DateTimeField(auto_now = True)
+
+    @property
+    def retry_dates(self):
+        return set(datetime.strptime(day, '%Y-%m-%d').date() for day in json.loads(self.retry or "[]"))
+
+    def __unicode__(self):
+        return u"%s as of %s" % (self.service, self.up_date)
+
+class CachedMetadata(models.Model):
+    """
+    a protrack program, series or description kept between loads
+
+    programs and series expire after PROTRACK_CACHE_TTL, quad_tab has no
+    up_date to tell us they changed, descriptions are dropped when their
+    progdesc rows are updated
+    """
+    kind = models.CharField(max_length = 12)
+    key = models.CharField(max_length = 64, db_index = True)
+    value = models.TextField(help_text = "pickled, base64 encoded")
+    fetched = models.DateTimeField()
+
+    class Meta:
+        unique_together = (('kind', 'key'),)
+
+    def __unicode__(self):
+        return u"%s %s" % (self.kind, self.key)
+
+class LoadCheckpoint(models.Model):
+    """
+    one (service, date range) unit of a load, completed once its airs are committed
+
+    an interrupted load leaves units without completed, --resume picks them
+    up; the units of a service's previous runs are dropped when a new one starts
+    """
+    service = models.ForeignKey(Service, related_name = 'protrack_checkpoints')
+    run = models.DateTimeField(help_text = "when the load the unit belongs to started")
+    up_date = models.DateTimeField(null = True, help_text = "protrack's server time when the run started")
+    start = models.DateField()
+    end = models.DateField()
+    open_ended = models.BooleanField(default = False, help_text = "the unit owns every air from start on")
+    completed = models.DateTimeField(null = True)
+
+    class Meta:
+        ordering = ('service', 'run', 'start')
+
+    def __unicode__(self):
+        return u"%s %s to %s" % (self.service, self.start, self.end)
+
+class ScheduleDay(models.Model):
+    """
+    a service's airs for a day, flattened for readers
+
+    airs is a json list in start order of dicts with start, end, duration,
+    episode, series and season details, rebuilt by load_protrack for every
+    day it loads so a schedule page is one indexed lookup instead of joins
+    through the generic airing relation
+    """
+    service = models.ForeignKey(Service, related_name = 'protrack_schedule')
+    date = models.DateField()
+    airs = models.TextField(default = "[]")
+    built = models.DateTimeField(auto_now = True)
+
+    class Meta:
+        unique_together = (('service', 'date'),)
+        ordering = ('service', 'date')
+
+    @property
+    def schedule(self):
+        return json.loads(self.airs)
+
+    def __unicode__(self):
+        return u"%s on %s" % (self.service, self.date)
+
+class Fingerprint(models.Model):
+    """
+    a digest of the protrack values a series, season or episode was last written from
+
+    keyed on protrack's ids, a season on "series,number", when protrack
+    hands the loader the same values again the record isn't written at all
+    """
+    kind = models.CharField(max_length = 12)
+    key = models.CharField(max_length = 64)
+    digest = models.CharField(max_length = 40)
+
+    class Meta:
+        unique_together = (('kind', 'key'),)
+
+    def __unicode__(self):
+        return u"%s %s" % (self.kind, self.key)
+
+class ServiceLease(models.Model):
+    """
+    which loader instance is loading a service, until when
+
+    a loader claims a service by taking its lease (a missing or expired one),
+    keeps renewing it while it works and releases it when done, so no two
+    instances, on one host or several, ever load the same service at once
+    """
+    service = models.OneToOneField(Service, related_name = 'protrack_lease')
+    owner = models.CharField(max_length = 128, help_text = "host:pid:token of the holder")
+    acquired = models.DateTimeField()
+    expires = models.DateTimeField()
+
+    def __unicode__(self):
+        return u"%s held by %s until %s" % (self.service, self.owner, self.expires)
+
+class StagedAir(models.Model):
+    """
+    an air13/safeair13 row unloaded by a --staging load, see protrack.staging
+    """
+    service = models.ForeignKey(Service, related_name = 'protrack_staged_airs')
+    version = models.IntegerField(db_index = True, help_text = "protrack version, an episode's protrack_id")
+    date = models.DateField()
+    time = models.TimeField()
+    duration = models.TimeField()
+    start = models.DateTimeField()
+    end = models.DateTimeField()
+
+    def __unicode__(self):
+        return u"%s %s %s version %s" % (self.service, self.date, self.time, self.version)
+
+class StagedEpisode(models.Model):
+    """
+    a protrack version aired by a --staging load, with its quad_tab, proguide and progdesc values
+
+    name, season and hd are already worked out from the title and nola code
+    """
+    service = models.ForeignKey(Service, related_name = 'protrack_staged_episodes')
+    version = models.IntegerField()
+    series = models.IntegerField(help_text = "protrack series")
+    name = models.CharField(max_length = 255, null = True)
+    short_description = models.TextField(blank = True)
+    description = models.TextField(blank = True)
+    full_nola = models.CharField(max_length = 15, null = True)
+    number = models.IntegerField(null = True)
+    total = models.IntegerField(null = True)
+    season = models.IntegerField(help_text = "season number from the nola code")
+    hd = models.BooleanField(default = False)
+    duration = models.TimeField()
+
+    class Meta:
+        unique_together = (('service', 'version'),)
+
+    def __unicode__(self):
+        return u"%s version %s" % (self.service, self.version)
+
+class StagedSeries(models.Model):
+    """
+    a protrack series aired by a --staging load, with its quad_tab and progdesc values
+    """
+    service = models.ForeignKey(Service, related_name = 'protrack_staged_series')
+    series = models.IntegerField(help_text = "protrack series")
+    name = models.CharField(max_length = 255)
+    keyname = models.CharField(max_length = 255)
+    nola = models.CharField(max_length = 6, null = True)
+    description = models.TextField(blank = True)
+
+    class Meta:
+        unique_together = (('service', 'series'),)
+
+    def __unicode__(self):
+        return u"%s series %s" % (self.service, self.series)
+
+class RecordLock(models.Model):
+    """
+    a row loaders lock before writing series, seasons and episodes (or deriving
+    a --staging load), so loaders on every host write them one transaction at a
+    time and never both create the same new one, see protrack.transactions
+    """
+    name = models.CharField(max_length = 32, unique = True)
+
+    def __unicode__(self):
+        return self.name
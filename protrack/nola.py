@@ -0,0 +1,86 @@
+"""
+NOLA code parsing
+
+A protrack version's nola code is the six character series base, six digits
+of season and episode number and an optional modifier, H or Z for HD:
+
+    ABCDEF 0012 03 H
+    base   season episode modifier
+
+Episodes numbered 100 and up (vsn_order) take three digits of the six, so the
+split depends on the number as well as the code.
+"""
+import threading
+
+#parsed codes kept for reuse, it's a handful per version so this is plenty
+CACHE_SIZE = 20000
+
+_interned = {}
+_interned_lock = threading.Lock()
+
+class NolaCode(object):
+    """
+    a parsed nola code, get them from NolaCode.parse so repeats are shared
+    """
+    __slots__ = ('nola', 'base', 'season', 'episode', 'modifier')
+
+    def __init__(self, nola, base, season, episode, modifier):
+        self.nola = nola
+        self.base = base
+        self.season = season
+        self.episode = episode
+        self.modifier = modifier
+
+    @property
+    def hd(self):
+        return self.modifier == 'H' or self.modifier == 'Z'
+
+    @property
+    def season_number(self):
+        return int(self.season)
+
+    @classmethod
+    def parse(cls, nola, number):
+        """
+        the NolaCode for a nola code and vsn_order
+        """
+        wide = number is not None and number >= 100
+        key = (nola, wide)
+        try:
+            return _interned[key]
+        except KeyError:
+            pass
+
+        needle = nola[6:]
+        modifier = None
+        if len(needle) > 6:
+            modifier = needle[6:]
+            needle = needle[0:6]
+
+        split = len(needle) - (3 if wide else 2)
+        code = cls(nola, nola[0:6], needle[0:split], needle[split:], modifier)
+
+        with _interned_lock:
+            if len(_interned) >= CACHE_SIZE:
+                _interned.clear()
+            return _interned.setdefault(key, code)
+
+    @classmethod
+    def parse_many(cls, codes):
+        """
+        parse an iterable of (nola code, vsn_order) pairs
+        """
+        return [cls.parse(nola, number) for nola, number in codes]
+
+    def __eq__(self, other):
+        return isinstance(other, NolaCode) and (self.nola, self.season) == (other.nola, other.season)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.nola, self.season))
+
+    def __repr__(self):
+        return "<NolaCode %s season %s episode %s%s>" % (self.base, self.season, self.episode,
+            " HD" if self.hd else "")
@@ -0,0 +1,120 @@
+"""
+Protrack extraction overlapped with the loader's writes
+
+Left to itself a service's load takes turns: it waits on informix for a batch
+of airs and what they need, then on django while the batch is written, each
+database idle while the other works.  extract() moves the informix side onto
+an Extractor thread with its own protrack session.  It streams a unit a
+sub-window of WINDOW_DAYS at a time and prefetches each batch into the loader's
+lookup, handing finished batches over a queue of at most depth of them.  The
+loader's thread only waits when extraction falls behind ('pipeline wait' in
+the stats), so a load takes about as long as the slower of the two.
+"""
+import logging, threading
+from Queue import Queue, Full
+
+from django.db import connections
+
+from protrack.db.delta import split_range
+from protrack.db.extract import air_batches
+from protrack.stats import phase
+from protrack.transactions import close_connection
+
+logger = logging.getLogger('django_protrack')
+
+#days of airs per protrack query, the first batch is ready as soon as the first day is
+WINDOW_DAYS = 1
+
+#how often a blocked extractor checks whether the loader gave up on it
+POLL_SECONDS = 0.5
+
+#end of the batches
+DONE = object()
+
+class Extractor(threading.Thread):
+    """
+    streams batches of airs into a bounded queue, prefetching what each needs into lookup
+    """
+    def __init__(self, session, lookup, stats, model, service, windows, batch_size, depth):
+        super(Extractor, self).__init__(name = 'protrack-extract-%s' % service.keyname)
+        self.daemon = True
+        self.session = session
+        self.lookup = lookup
+        self.stats = stats
+        self.model = model
+        self.service = service
+        self.windows = windows
+        self.batch_size = batch_size
+        self.queue = Queue(max(1, depth))
+        self.stopping = threading.Event()
+        self.error = None
+
+    def put(self, item):
+        """
+        queue item once there's room, False if the loader stopped listening first
+        """
+        while not self.stopping.is_set():
+            try:
+                self.queue.put(item, timeout = POLL_SECONDS)
+                return True
+            except Full:
+                pass
+        return False
+
+    def run(self):
+        #the lookup's cache reads and writes go through this thread's django connection
+        self.stats.start_thread(connections["default"])
+        self.stats.service(self.service.keyname)
+        try:
+            for start, end in self.windows:
+                batches = air_batches(self.session, self.model, self.service.protrack_key, start, end, self.batch_size)
+                try:
+                    while True:
+                        with phase(self.stats, 'extraction'):
+                            rows = next(batches, None)
+                        if rows is None:
+                            break
+
+                        with phase(self.stats, 'description fetch'):
+                            self.lookup.prefetch(rows, session = self.session)
+                        if not self.put(rows):
+                            return
+                finally:
+                    batches.close()
+        except Exception as e:
+            logger.exception("failed extracting airs for %s." % self.service.name)
+            self.error = e
+        finally:
+            self.put(DONE)
+            self.session.close()
+            self.stats.stop_thread(connections["default"])
+            close_connection()
+
+    def stop(self):
+        self.stopping.set()
+        self.join()
+
+def extract(session, lookup, stats, model, service, start, end, batch_size, depth):
+    """
+    batches (lists of AirRow) of the service's airs from start to end out of
+    model, Air13 or SafeAir13, extracted and prefetched into lookup up to depth
+    batches ahead on a thread of their own, session is that thread's and closed
+    by it
+
+    an extraction error is raised here once the batches before it are through
+    """
+    extractor = Extractor(session, lookup, stats, model, service, split_range(start, end, WINDOW_DAYS),
+        batch_size, depth)
+    extractor.start()
+    try:
+        while True:
+            with phase(stats, 'pipeline wait'):
+                rows = extractor.queue.get()
+            if rows is DONE:
+                break
+            yield rows
+
+        if extractor.error is not None:
+            raise extractor.error
+    finally:
+        extractor.stop()
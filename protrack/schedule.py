@@ -0,0 +1,73 @@
+"""
+Flattened per-day schedules
+
+Rendering a day of a channel means Air -> airing_type/airing_id -> Episode ->
+Season -> Series for every air.  rebuild_days does those joins once, after a
+load, and keeps the result in ScheduleDay, one row per service and date.
+"""
+import json
+
+from django.contrib.contenttypes.models import ContentType
+from libazpm.contrib.chronologia.models import Air, Episode
+
+from protrack.models import ScheduleDay
+from protrack.db.lookup import chunked
+
+def _iso(value):
+    return value.isoformat() if value is not None else None
+
+def flatten(air, episode):
+    """
+    the json-able entry for an air of an episode
+    """
+    season = episode.season if episode is not None and episode.season_id else None
+    series = episode.series if episode is not None and episode.series_id else None
+    return {
+        'start': _iso(air.start),
+        'end': _iso(air.end),
+        'time': _iso(air.time),
+        'duration': _iso(air.duration),
+        'episode': episode and {
+            'id': episode.pk,
+            'protrack_id': episode.protrack_id,
+            'name': episode.name,
+            'number': episode.number,
+            'short_description': episode.short_description,
+            'description': episode.description,
+            'hd': bool(episode.high_definition),
+            'nola': episode.full_nola,
+        },
+        'season': season and {'id': season.pk, 'number': season.number, 'total': season.total},
+        'series': series and {'id': series.pk, 'name': series.name, 'keyname': series.keyname},
+    }
+
+def rebuild_days(service, dates, batch_size = 500):
+    """
+    rebuild the ScheduleDay of service for each of dates, returns how many airs went in
+    """
+    dates = sorted(set(dates))
+    if not dates:
+        return 0
+
+    ct = ContentType.objects.get_for_model(Episode)
+    airs = []
+    for chunk in chunked(dates, batch_size):
+        airs.extend(Air.objects.using("default").filter(service = service, airing_type = ct,
+            date__in = chunk).order_by('date', 'start'))
+
+    episodes = {}
+    for chunk in chunked(sorted(set(air.airing_id for air in airs)), batch_size):
+        for episode in Episode.objects.using("default").select_related("season", "series").filter(pk__in = chunk):
+            episodes[episode.pk] = episode
+
+    #a day without airs is still built, readers find it empty rather than missing
+    days = dict((day, []) for day in dates)
+    for air in airs:
+        days[air.date].append(flatten(air, episodes.get(air.airing_id)))
+
+    built = [ScheduleDay(service = service, date = day, airs = json.dumps(entries)) for day, entries in days.items()]
+    for chunk in chunked(dates, batch_size):
+        ScheduleDay.objects.using("default").filter(service = service, date__in = chunk).delete()
+    ScheduleDay.objects.using("default").bulk_create(built, batch_size = batch_size)
+
+    return len(airs)
@@ -0,0 +1,353 @@
+"""
+Staged loads, protrack slices mirrored into the django database
+
+A row by row load works out every air's episode, season and series in python,
+a query or two to each database at a time.  A staged load streams a unit's airs
+out of protrack once, with the programs, series, descriptions and guide text
+they need (the chunked IN queries of ProtrackLookup and air_batches), into the
+StagedAir, StagedEpisode and StagedSeries tables.  Titles and nola codes are
+worked out while unloading, once per distinct program and series.
+
+derive() then makes Series, Season, Episode and Air match the staging tables
+with a few statements next to them: updates from correlated subqueries where
+a value differs, deletes of airs without a staged match, and the rows that are
+new selected with an anti-join and written with bulk_create, so model defaults
+apply.  Seasons are only created or changed for new episodes, which are few.
+"""
+import re, logging, threading
+
+from django.db import connections
+from django.template.defaultfilters import slugify
+from libazpm.contrib.chronologia.models import Series, Season, Episode, Air
+
+from protrack.models import StagedAir, StagedEpisode, StagedSeries
+from protrack.db.lookup import chunked
+from protrack.fingerprints import forget_fingerprints
+from protrack.stats import phase
+from protrack.titlecase import titlecase, capwords
+from protrack.transactions import lock_records
+
+logger = logging.getLogger('django_protrack')
+
+#workers share series and seasons, one derive at a time (and its commit) keeps them from creating one twice,
+#a loader's threads queue here, loaders on other hosts (and row by row writes) on lock_records()
+deriving = threading.Lock()
+
+def clear(service):
+    """
+    empty the staging tables of service
+    """
+    for model in (StagedAir, StagedEpisode, StagedSeries):
+        model.objects.using("default").filter(service = service).delete()
+
+def unload(service, batches, lookup, batch_size = 500, stats = None):
+    """
+    stage batches (lists of AirRow) of the service's airs and the episodes and
+    series they air, out of lookup (a ProtrackLookup) the batches were
+    prefetched into
+
+    rows protrack has no program or series for are skipped, like the row by
+    row load skips rows that fail
+
+    returns a (number of rows, dates with skipped rows) tuple
+    """
+    clear(service)
+    versions = set()
+    series = set()
+    skipped = set()
+    counter = 0
+    for rows in batches:
+        airs = []
+        episodes = []
+        staged_series = []
+        for row in rows:
+            counter += 1
+            program = lookup.program(row.program)
+            series_row = lookup.series_row(row.series)
+            if program is None or series_row is None:
+                logger.error("skipped %s %s %s version %s, protrack has no program or series for it." % (
+                    service.keyname, row.airdate, row.airtime, row.version))
+                skipped.add(row.airdate)
+                continue
+
+            airs.append(StagedAir(service = service, version = row.version, date = row.airdate, time = row.time,
+                duration = row.duration, start = row.start, end = row.end))
+
+            if row.version not in versions:
+                versions.add(row.version)
+                #the fields process_episode gives a new episode
+                nola = lookup.nola(row.program)
+                if str(program.title).upper() == "NONE" or program.title == None:
+                    name = None
+                else:
+                    with phase(stats, 'titlecase'):
+                        name = capwords(str(program.title)).strip()
+                episodes.append(StagedEpisode(service = service, version = row.version, series = row.series,
+                    name = name, short_description = unicode(row.short_description or "", 'utf8'),
+                    description = lookup.description(row.series, row.program, row.version),
+                    full_nola = program.nola_code, number = program.number, total = program.total,
+                    season = int(nola.season_number), hd = nola.hd, duration = row.duration))
+
+            if row.series not in series:
+                series.add(row.series)
+                #and the ones process_series writes
+                with phase(stats, 'titlecase'):
+                    name = titlecase(re.sub('{[\w-]+}', '', series_row.title))
+                staged_series.append(StagedSeries(service = service, series = row.series, name = name,
+                    keyname = slugify(u"%s" % unicode(name, "utf8", errors = "ignore")), nola = series_row.nola,
+                    description = lookup.description(row.series, -1, -1)))
+
+        StagedAir.objects.using("default").bulk_create(airs, batch_size = batch_size)
+        StagedEpisode.objects.using("default").bulk_create(episodes, batch_size = batch_size)
+        StagedSeries.objects.using("default").bulk_create(staged_series, batch_size = batch_size)
+
+    return counter, skipped
+
+class _Names(dict):
+    """
+    quoted table and column names, table for a model's table, table_field for its columns
+    """
+    def __init__(self, connection):
+        super(_Names, self).__init__()
+        qn = connection.ops.quote_name
+        for alias, model, fields in (
+                ('series', Series, ('protrack_id', 'name', 'keyname', 'nola', 'description')),
+                ('season', Season, ('series',)),
+                ('episode', Episode, ('protrack_id', 'short_description', 'description', 'season', 'series')),
+                ('air', Air, ('service', 'airing_type', 'airing_id', 'date', 'time', 'duration', 'start', 'end')),
+                ('staged_air', StagedAir, ('service', 'version', 'date', 'time', 'duration', 'start', 'end')),
+                ('staged_episode', StagedEpisode, ('service', 'version', 'series', 'short_description', 'description')),
+                ('staged_series', StagedSeries, ('service', 'series', 'name', 'keyname', 'nola', 'description'))):
+            self[alias] = qn(model._meta.db_table)
+            self['%s_pk' % alias] = qn(model._meta.pk.column)
+            for field in fields:
+                self['%s_%s' % (alias, field)] = qn(model._meta.get_field(field).column)
+
+def _differs(a, b):
+    """
+    a SQL condition true when a and b differ, NULLs included
+    """
+    return "({0} <> {1} OR ({0} IS NULL AND {1} IS NOT NULL) OR ({0} IS NOT NULL AND {1} IS NULL))".format(a, b)
+
+def _update(cursor, service, table, key, staged, staged_key, staged_service, columns):
+    """
+    set the columns, (target, staged) pairs, of every table row that has a
+    staged row (staged_key = key) of service with different values
+
+    returns how many rows were updated
+    """
+    match = "s.{0} = %s AND s.{1} = {2}.{3}".format(staged_service, staged_key, table, key)
+    sql = "UPDATE {0} SET {1} WHERE EXISTS (SELECT 1 FROM {2} s WHERE {3} AND ({4}))".format(
+        table,
+        ", ".join("{0} = (SELECT s.{1} FROM {2} s WHERE {3})".format(target, source, staged, match)
+            for target, source in columns),
+        staged,
+        match,
+        " OR ".join(_differs("s.%s" % source, "%s.%s" % (table, target)) for target, source in columns))
+    cursor.execute(sql, [service.pk] * (len(columns) + 1))
+    return cursor.rowcount
+
+def derive_series(cursor, n, service, batch_size = 500):
+    """
+    update and create the Series of the service's staged series
+    """
+    _update(cursor, service, n['series'], n['series_protrack_id'], n['staged_series'], n['staged_series_series'],
+        n['staged_series_service'], [(n['series_%s' % f], n['staged_series_%s' % f])
+            for f in ('name', 'keyname', 'nola', 'description')])
+
+    known = Series.objects.using("default").filter(protrack_id__isnull = False).values('protrack_id')
+    new = StagedSeries.objects.using("default").filter(service = service).exclude(series__in = known)
+    Series.objects.using("default").bulk_create([Series(protrack_id = s.series, name = s.name, keyname = s.keyname,
+        nola = s.nola, description = s.description) for s in new], batch_size = batch_size)
+
+def derive_seasons(new, batch_size = 500):
+    """
+    the Season of every (protrack series, season number) new episodes (StagedEpisode) belong to,
+    created or with its total updated the way process_season would
+    """
+    totals = {}
+    for staged in new:
+        totals[(staged.series, staged.season)] = staged.total
+
+    seasons = {}
+    for chunk in chunked(sorted(set(series for series, number in totals)), batch_size):
+        for season in Season.objects.using("default").select_related("series").filter(series__protrack_id__in = chunk):
+            seasons.setdefault((season.series.protrack_id, season.number), season)
+
+    parents = {}
+    for chunk in chunked(sorted(set(series for series, number in totals)), batch_size):
+        for series in Series.objects.using("default").filter(protrack_id__in = chunk):
+            parents[series.protrack_id] = series
+
+    created = []
+    for key, total in sorted(totals.items()):
+        if key in seasons:
+            if seasons[key].total != total:
+                Season.objects.using("default").filter(pk = seasons[key].pk).update(total = total)
+        else:
+            created.append(Season(series = parents[key[0]], number = key[1], total = total))
+    Season.objects.using("default").bulk_create(created, batch_size = batch_size)
+
+    if created:
+        #bulk_create doesn't give us the keys back
+        for chunk in chunked(sorted(set(season.series.protrack_id for season in created)), batch_size):
+            for season in Season.objects.using("default").select_related("series").filter(series__protrack_id__in = chunk):
+                seasons.setdefault((season.series.protrack_id, season.number), season)
+
+    return seasons
+
+def derive_episodes(cursor, n, service, batch_size = 500):
+    """
+    update the Episodes of the service's staged versions and create the missing ones
+    """
+    _update(cursor, service, n['episode'], n['episode_protrack_id'], n['staged_episode'],
+        n['staged_episode_version'], n['staged_episode_service'], [(n['episode_%s' % f], n['staged_episode_%s' % f])
+            for f in ('short_description', 'description')])
+
+    #an episode without a series takes its season's
+    cursor.execute("""
+        UPDATE {episode} SET {episode_series} = (
+            SELECT {season}.{season_series} FROM {season} WHERE {season}.{season_pk} = {episode}.{episode_season})
+        WHERE {episode_series} IS NULL AND {episode_season} IS NOT NULL
+        AND {episode_protrack_id} IN (SELECT s.{staged_episode_version} FROM {staged_episode} s
+            WHERE s.{staged_episode_service} = %s)
+    """.format(**n), [service.pk])
+
+    known = Episode.objects.using("default").filter(protrack_id__isnull = False).values('protrack_id')
+    new = list(StagedEpisode.objects.using("default").filter(service = service).exclude(version__in = known))
+    seasons = derive_seasons(new, batch_size)
+
+    episodes = []
+    for staged in new:
+        season = seasons[(staged.series, staged.season)]
+        episodes.append(Episode(protrack_id = staged.version, name = staged.name,
+            short_description = staged.short_description, description = staged.description,
+            duration = staged.duration, full_nola = staged.full_nola, number = staged.number,
+            high_definition = staged.hd, season = season, series = season.series))
+    Episode.objects.using("default").bulk_create(episodes, batch_size = batch_size)
+
+def rewritten_dates(cursor, n, service):
+    """
+    the dates of the service's staged airs whose episode or series deriving
+    creates or changes, run before derive_series and derive_episodes
+    """
+    cursor.execute("""
+        SELECT DISTINCT a.{staged_air_date}
+        FROM {staged_air} a
+        INNER JOIN {staged_episode} s ON s.{staged_episode_service} = a.{staged_air_service}
+            AND s.{staged_episode_version} = a.{staged_air_version}
+        LEFT OUTER JOIN {episode} ON {episode}.{episode_protrack_id} = a.{staged_air_version}
+        LEFT OUTER JOIN {staged_series} ss ON ss.{staged_series_service} = a.{staged_air_service}
+            AND ss.{staged_series_series} = s.{staged_episode_series}
+        LEFT OUTER JOIN {series} ON {series}.{series_protrack_id} = s.{staged_episode_series}
+        WHERE a.{staged_air_service} = %s AND ({episode}.{episode_pk} IS NULL OR {episode}.{episode_series} IS NULL
+            OR {episode_differs} OR (ss.{staged_series_series} IS NOT NULL
+                AND ({series}.{series_protrack_id} IS NULL OR {series_differs})))
+    """.format(
+        episode_differs = " OR ".join(_differs("s.%s" % n['staged_episode_%s' % f], "%s.%s" % (n['episode'],
+            n['episode_%s' % f])) for f in ('short_description', 'description')),
+        series_differs = " OR ".join(_differs("ss.%s" % n['staged_series_%s' % f], "%s.%s" % (n['series'],
+            n['series_%s' % f])) for f in ('name', 'keyname', 'nola', 'description')), **n), [service.pk])
+    return set(on_date for on_date, in cursor.fetchall())
+
+def derive_airs(cursor, n, service, ct, start, end = None, spare = (), batch_size = 500):
+    """
+    make the service's airs from start to end (open ended without one) match
+    the staged airs, never deleting from the dates in spare
+
+    returns a (created, updated, deleted, dates) tuple, the counts and the
+    dates any of them were on
+    """
+    window = "{air}.{air_service} = %s AND {air}.{air_date} >= %s".format(**n)
+    window_params = [service.pk, start]
+    if end is not None:
+        window += " AND {air}.{air_date} <= %s".format(**n)
+        window_params.append(end)
+    if spare:
+        window += " AND {air}.{air_date} NOT IN ({spare})".format(spare = ", ".join(["%s"] * len(spare)), **n)
+        window_params.extend(sorted(spare))
+
+    #the staged airs of the service that are the air in the outer query
+    matched = """
+        FROM {staged_air} s, {episode} e
+        WHERE s.{staged_air_service} = %s AND e.{episode_protrack_id} = s.{staged_air_version}
+        AND {air}.{air_airing_type} = %s AND {air}.{air_airing_id} = e.{episode_pk}
+        AND s.{staged_air_date} = {air}.{air_date} AND s.{staged_air_time} = {air}.{air_time}
+        AND s.{staged_air_duration} = {air}.{air_duration}
+    """.format(**n)
+    matched_params = [service.pk, ct.pk]
+
+    dates = set()
+    stale = "{window} AND NOT EXISTS (SELECT 1 {matched})".format(window = window, matched = matched)
+    cursor.execute("SELECT DISTINCT {air}.{air_date} FROM {air} WHERE {stale}".format(stale = stale, **n),
+        window_params + matched_params)
+    dates.update(on_date for on_date, in cursor.fetchall())
+    cursor.execute("DELETE FROM {air} WHERE {stale}".format(stale = stale, **n), window_params + matched_params)
+    deleted = cursor.rowcount
+
+    moved = "{window} AND EXISTS (SELECT 1 {matched} AND ({start_differs} OR {end_differs}))".format(
+        window = window, matched = matched,
+        start_differs = _differs("s.{staged_air_start}".format(**n), "{air}.{air_start}".format(**n)),
+        end_differs = _differs("s.{staged_air_end}".format(**n), "{air}.{air_end}".format(**n)))
+    cursor.execute("SELECT DISTINCT {air}.{air_date} FROM {air} WHERE {moved}".format(moved = moved, **n),
+        window_params + matched_params)
+    dates.update(on_date for on_date, in cursor.fetchall())
+    cursor.execute("""
+        UPDATE {air} SET {air_start} = (SELECT MIN(s.{staged_air_start}) {matched}),
+            {air_end} = (SELECT MIN(s.{staged_air_end}) {matched})
+        WHERE {moved}
+    """.format(matched = matched, moved = moved, **n), matched_params * 2 + window_params + matched_params)
+    updated = cursor.rowcount
+
+    cursor.execute("""
+        SELECT DISTINCT e.{episode_pk}, s.{staged_air_date}, s.{staged_air_time}, s.{staged_air_duration},
+            s.{staged_air_start}, s.{staged_air_end}
+        FROM {staged_air} s, {episode} e
+        WHERE s.{staged_air_service} = %s AND e.{episode_protrack_id} = s.{staged_air_version}
+        AND NOT EXISTS (SELECT 1 FROM {air}
+            WHERE {air}.{air_service} = %s AND {air}.{air_airing_type} = %s AND {air}.{air_airing_id} = e.{episode_pk}
+            AND {air}.{air_date} = s.{staged_air_date} AND {air}.{air_time} = s.{staged_air_time}
+            AND {air}.{air_duration} = s.{staged_air_duration})
+    """.format(**n), [service.pk, service.pk, ct.pk])
+    airs = [Air(service = service, airing_type = ct, airing_id = airing_id, date = on_date, time = at_time,
+        duration = duration, start = starts, end = ends)
+        for airing_id, on_date, at_time, duration, starts, ends in cursor.fetchall()]
+    Air.objects.using("default").bulk_create(airs, batch_size = batch_size)
+    dates.update(air.date for air in airs)
+
+    return len(airs), updated, deleted, dates
+
+def derive(service, ct, start, end = None, spare = (), batch_size = 500):
+    """
+    write the service's staged series, seasons, episodes and airs from start
+    to end (open ended without one), then empty its staging tables
+
+    runs in the caller's transaction, hold `deriving` until that's committed
+    when other threads derive too, loaders on other hosts wait on
+    lock_records() until then
+
+    returns the (created, updated, deleted) counts of the airs and the dates
+    whose schedules changed, the airs' and those of the airs of every episode
+    or series written
+    """
+    connection = connections["default"]
+    cursor = connection.cursor()
+    n = _Names(connection)
+
+    lock_records()
+    rewritten = rewritten_dates(cursor, n, service)
+    derive_series(cursor, n, service, batch_size)
+    derive_episodes(cursor, n, service, batch_size)
+    changes = derive_airs(cursor, n, service, ct, start, end, spare, batch_size)
+    changes[3].update(rewritten)
+
+    #what was written here isn't what the fingerprints were taken from, the next row by row load writes it again
+    forget_fingerprints('series', StagedSeries.objects.using("default").filter(
+        service = service).values_list('series', flat = True), batch_size)
+    forget_fingerprints('episode', StagedEpisode.objects.using("default").filter(
+        service = service).values_list('version', flat = True), batch_size)
+    forget_fingerprints('season', set(StagedEpisode.objects.using("default").filter(
+        service = service).values_list('series', 'season')), batch_size)
+    clear(service)
+
+    return changes
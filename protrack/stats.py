@@ -0,0 +1,190 @@
+"""
+Timing and query counting for protrack loads
+
+A LoadStats is shared by every thread of a load.  Code marks what it's doing
+with phase(stats, name), phases nest and each is charged only its own time
+and queries, so the totals add up to the load.  Protrack queries are counted
+by CountingSession, django queries by a cursor wrapper installed on the
+thread's connection.
+"""
+import heapq, threading
+from collections import defaultdict
+from time import time as now
+
+from django.db.backends.util import CursorWrapper
+
+class _NoPhase(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+def phase(stats, name, label = None):
+    """
+    stats.phase(name, label), or a no-op when not collecting stats
+    """
+    if stats is None:
+        return _NoPhase()
+    return stats.phase(name, label)
+
+class Phase(object):
+    """
+    one level of the calling thread's phase stack
+
+    with a label the phase's whole time (nested phases included) is a
+    candidate for the slowest of its name
+    """
+    def __init__(self, stats, name, label = None):
+        self.stats = stats
+        self.name = name
+        self.label = label
+
+    def __enter__(self):
+        local = self.stats.local
+        self.started = now()
+        self.protrack = local.protrack
+        self.django = local.django
+        #what nested phases took, we only own the rest
+        self.children = [0.0, 0, 0]
+        local.stack.append(self)
+
+    def __exit__(self, *exc_info):
+        local = self.stats.local
+        local.stack.pop()
+        spent = [now() - self.started, local.protrack - self.protrack, local.django - self.django]
+        if local.stack:
+            parent = local.stack[-1].children
+            for i, value in enumerate(spent):
+                parent[i] += value
+
+        own = [value - child for value, child in zip(spent, self.children)]
+        self.stats.add(self.name, own)
+        if self.label is not None:
+            self.stats.record(self.name, spent[0], self.label)
+
+class LoadStats(object):
+    """
+    per phase and per service timings and query counts, plus the slowest rows and series
+    """
+    def __init__(self, top = 10):
+        self.top = top
+        self.local = threading.local()
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        start counting afresh, threads already set up keep counting
+        """
+        self.started = now()
+        self.phases = defaultdict(lambda: [0.0, 0, 0, 0]) # seconds, calls, protrack queries, django queries
+        self.services = defaultdict(lambda: defaultdict(lambda: [0.0, 0, 0, 0]))
+        self.slowest = defaultdict(list) # kind -> heap of (seconds, label)
+
+    def start_thread(self, connection = None):
+        """
+        set up the calling thread, counting django queries on connection
+        """
+        self.local.protrack = 0
+        self.local.django = 0
+        self.local.stack = []
+        self.local.service = None
+        if connection is not None:
+            connection.use_debug_cursor = True
+            connection.make_debug_cursor = lambda cursor: CountingCursor(cursor, connection, self)
+
+    def stop_thread(self, connection = None):
+        """
+        stop counting django queries on connection
+        """
+        if connection is not None:
+            connection.use_debug_cursor = None
+            del connection.make_debug_cursor
+
+    def service(self, name):
+        """
+        charge the calling thread's phases to a service from now on
+        """
+        self.local.service = name
+
+    def phase(self, name, label = None):
+        return Phase(self, name, label)
+
+    def add(self, name, own):
+        seconds, protrack, django = own
+        with self._lock:
+            targets = [self.phases[name]]
+            if self.local.service is not None:
+                targets.append(self.services[self.local.service][name])
+            for totals in targets:
+                totals[0] += seconds
+                totals[1] += 1
+                totals[2] += protrack
+                totals[3] += django
+
+    def record(self, kind, seconds, label):
+        """
+        keep label if it's one of the top slowest of its kind
+        """
+        with self._lock:
+            heap = self.slowest[kind]
+            if len(heap) < self.top:
+                heapq.heappush(heap, (seconds, label))
+            elif seconds > heap[0][0]:
+                heapq.heapreplace(heap, (seconds, label))
+
+    @staticmethod
+    def _phases(phases):
+        return dict((name, {
+            'seconds': round(seconds, 3), 'calls': calls,
+            'protrack_queries': protrack, 'django_queries': django,
+        }) for name, (seconds, calls, protrack, django) in phases.items())
+
+    def summary(self):
+        """
+        the whole load as a json-able dict
+        """
+        with self._lock:
+            return {
+                'seconds': round(now() - self.started, 3),
+                'protrack_queries': sum(p[2] for p in self.phases.values()),
+                'django_queries': sum(p[3] for p in self.phases.values()),
+                'phases': self._phases(self.phases),
+                'services': dict((service, self._phases(phases)) for service, phases in self.services.items()),
+                'slowest': dict((kind, [{'seconds': round(seconds, 3), 'label': label}
+                    for seconds, label in sorted(heap, reverse = True)]) for kind, heap in self.slowest.items()),
+            }
+
+class CountingSession(object):
+    """
+    a protrack session that counts the queries it runs
+    """
+    def __init__(self, session, stats):
+        self.session = session
+        self.stats = stats
+
+    def execute(self, sql, params = None):
+        self.stats.local.protrack += 1
+        return self.session.execute(sql, params or {})
+
+    def close(self):
+        self.session.close()
+
+class CountingCursor(CursorWrapper):
+    """
+    counts django queries instead of logging them like CursorDebugWrapper
+    """
+    def __init__(self, cursor, db, stats):
+        super(CountingCursor, self).__init__(cursor, db)
+        self.stats = stats
+
+    def execute(self, sql, params = ()):
+        self.set_dirty()
+        self.stats.local.django += 1
+        return self.cursor.execute(sql, params)
+
+    def executemany(self, sql, param_list):
+        self.set_dirty()
+        self.stats.local.django += 1
+        return self.cursor.executemany(sql, param_list)
@@ -0,0 +1,156 @@
+"""
+Batched transactions for the loader
+
+Left to autocommit every save is its own transaction, a commit (and an fsync)
+per statement.  BatchTransaction keeps a managed transaction open and commits
+it every so many rows instead, running each row under a savepoint so a row
+that fails is rolled back, logged and skipped without losing the rest of the
+batch.  Rows failing one after another mean something bigger is wrong (informix
+went away, say), past TOLERANCE of them the error is raised as usual.
+
+Series, seasons and episodes are shared between workers.  With more than
+one, a row that writes one has the IdentityMap commit the batch right there
+(flush), so no other thread references a row this one could still roll back,
+and the rest of the row carries on under a fresh savepoint.
+
+Loaders on other hosts share those records too.  Every write to one is made
+holding lock_records(), a RecordLock row locked until the transaction ends,
+and a new one is looked for again under it, so whoever comes second finds
+the record the first created instead of making it again.
+"""
+import logging
+
+from django.db import connections, transaction
+
+from protrack.models import RecordLock
+from protrack.stats import phase
+
+logger = logging.getLogger('django_protrack')
+
+#consecutive failed rows skipped before giving up on the batch
+TOLERANCE = 25
+
+#the RecordLock row series, season and episode writes queue on
+RECORDS = 'records'
+
+class _Row(object):
+    """
+    one row of a BatchTransaction, under its own savepoint
+    """
+    def __init__(self, batch, label):
+        self.batch = batch
+        self.label = label
+
+    def __enter__(self):
+        self.begin()
+        self.batch.current = self
+
+    def begin(self):
+        batch = self.batch
+        self.mark = batch.identity.mark() if batch.identity is not None else None
+        self.sid = transaction.savepoint(using = batch.using)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        batch = self.batch
+        batch.current = None
+        if exc_type is None:
+            transaction.savepoint_commit(self.sid, using = batch.using)
+            batch.failing = 0
+            batch.done()
+            return False
+
+        if not issubclass(exc_type, Exception):
+            return False
+
+        transaction.savepoint_rollback(self.sid, using = batch.using)
+        if batch.identity is not None:
+            batch.identity.rolled_back(self.mark)
+
+        batch.failing += 1
+        if batch.failing > batch.tolerance:
+            return False
+
+        logger.error("skipped %s" % self.label, exc_info = (exc_type, exc_value, traceback))
+        batch.skipped += 1
+        return True
+
+class BatchTransaction(object):
+    """
+    a managed transaction committed every `every` rows
+
+    identity, the load's IdentityMap, is told about commits and rollbacks so
+    it never hands out instances whose rows were rolled back
+    """
+    def __init__(self, every, using = "default", identity = None, stats = None, tolerance = TOLERANCE):
+        self.every = max(1, every)
+        self.using = using
+        self.identity = identity
+        self.stats = stats
+        self.tolerance = tolerance
+        self.pending = 0
+        self.skipped = 0
+        self.failing = 0
+        self.current = None
+
+    def __enter__(self):
+        transaction.enter_transaction_management(using = self.using)
+        transaction.managed(True, using = self.using)
+        if self.identity is not None:
+            self.identity.bind(self.flush)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.commit()
+            else:
+                transaction.rollback(using = self.using)
+                if self.identity is not None:
+                    self.identity.rolled_back()
+        finally:
+            if self.identity is not None:
+                self.identity.bind(None)
+            transaction.leave_transaction_management(using = self.using)
+        return False
+
+    def row(self, label):
+        """
+        run a row under a savepoint, a failure rolls back and skips just that row
+        """
+        return _Row(self, label)
+
+    def done(self):
+        self.pending += 1
+        if self.pending >= self.every:
+            self.commit()
+
+    def flush(self):
+        """
+        commit now, in the middle of a row too; a failure later in the row only
+        rolls back to here
+        """
+        self.commit()
+        if self.current is not None:
+            self.current.begin()
+
+    def commit(self):
+        with phase(self.stats, 'commit'):
+            transaction.commit(using = self.using)
+        if self.identity is not None:
+            self.identity.committed()
+        self.pending = 0
+
+def lock_records(using = "default"):
+    """
+    lock the RecordLock row until the calling thread's transaction ends, whichever host it's on
+    """
+    RecordLock.objects.using(using).get_or_create(name = RECORDS)
+    list(RecordLock.objects.using(using).select_for_update().filter(name = RECORDS))
+
+def close_connection():
+    """
+    close the calling thread's django connections, django opens them per
+    thread and the connections of a thread that's done are never reused
+    """
+    for connection in connections.all():
+        connection.close()